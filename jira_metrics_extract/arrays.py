@@ -0,0 +1,97 @@
+import numpy as np
+
+
+def floor_days(values):
+    """Round an array of datetime64 values down to whole days, keeping NaT
+    """
+    return np.asarray(values, dtype='datetime64[ns]').astype('datetime64[D]').astype('datetime64[ns]')
+
+
+def group_ids(starts):
+    """Return an id for the group of each element, given a boolean array that
+    is True where a new group starts.
+    """
+    return np.cumsum(starts)
+
+
+def grouped_shift(values, groups, fill):
+    """Shift `values` back by one within each run of equal `groups`, as
+    `Series.shift(-1)` would for each group on its own, putting `fill` in the
+    last element of each group.
+    """
+    values = np.asarray(values)
+    groups = np.asarray(groups)
+
+    result = np.empty_like(values)
+    if len(values) == 0:
+        return result
+
+    result[:-1] = values[1:]
+
+    last = np.ones(len(values), dtype=bool)
+    last[:-1] = groups[1:] != groups[:-1]
+    result[last] = fill
+
+    return result
+
+
+def expand_intervals(starts, ends):
+    """Expand inclusive integer intervals `[starts[i], ends[i]]` into one
+    element per point. Returns `(rows, points)`: the index of the interval
+    each point came from, and the point itself, in interval order. Empty
+    intervals (end before start) give no points.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    lengths = np.maximum(ends - starts + 1, 0)
+    rows = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return rows, starts[rows] + offsets
+
+
+def backfill_rows(values, missing, fill):
+    """Replace the `missing` cells of a 2D array with the next value to their
+    right that is not missing, as `DataFrame.fillna(method='bfill', axis=1)`
+    would, or with `fill` if there is none.
+    """
+    values = np.asarray(values)
+    rows, columns = values.shape
+
+    # Column of the next value that is not missing, or `columns` if none
+    source = np.where(missing, columns, np.arange(columns))
+    source = np.minimum.accumulate(source[:, ::-1], axis=1)[:, ::-1]
+
+    padded = np.empty((rows, columns + 1), dtype=values.dtype)
+    padded[:, :columns] = values
+    padded[:, columns] = fill
+
+    return padded[np.arange(rows)[:, np.newaxis], source]
+
+
+def rightmost_index(mask):
+    """Return the column of the rightmost True value in each row of a 2D
+    boolean array, or -1 for rows without one.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if mask.shape[1] == 0:
+        return np.full(mask.shape[0], -1, dtype=np.int64)
+
+    index = mask.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+    return np.where(mask.any(axis=1), index, -1)
+
+
+def keep_rightmost(values):
+    """Return a copy of a 2D array with every value zeroed except the
+    rightmost non-zero value in each row, e.g. to count each issue only in
+    the furthest workflow state it has reached.
+    """
+    values = np.asarray(values)
+    result = np.zeros_like(values)
+
+    index = rightmost_index(values != 0)
+    rows = np.flatnonzero(index >= 0)
+    result[rows, index[rows]] = values[rows, index[rows]]
+
+    return result
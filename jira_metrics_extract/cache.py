@@ -0,0 +1,143 @@
+import os
+import io
+import json
+import time
+import hashlib
+import datetime
+
+DEFAULT_CACHE_DIRECTORY = '.jira-cache'
+
+# How long to keep the list of JIRA fields, in seconds
+DEFAULT_FIELDS_TTL = 3600
+
+
+def cache_directory(setting):
+    """Return the directory named by the `Cache Jira` setting, or None if
+    caching is switched off. `True` selects the default directory.
+    """
+    if setting is None or setting is False:
+        return None
+    if setting is True:
+        return DEFAULT_CACHE_DIRECTORY
+    return str(setting)
+
+
+def cache_name(*parts):
+    """Return a file name that identifies the cache for the given parts
+    (server, query string, etc.)
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def read_json(path):
+    """Return the decoded contents of a JSON file, or None if it does not
+    exist or cannot be read.
+    """
+    try:
+        with io.open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    """Write `data` to `path` as JSON, replacing the file only once the new
+    content has been written in full.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    tmp_path = path + '.tmp'
+    with io.open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(u'%s' % json.dumps(data))
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def cached_fields(directory, server, fetch, ttl=DEFAULT_FIELDS_TTL, refresh=False):
+    """Return the list of JIRA field definitions for `server`, calling
+    `fetch()` only if there is no copy on disk younger than `ttl` seconds,
+    or if `refresh` is set.
+    """
+    path = os.path.join(directory, 'fields-%s.json' % cache_name(server))
+
+    data = None if refresh else read_json(path)
+    if data is not None and time.time() - data.get('fetched', 0) < ttl:
+        return data['fields']
+
+    fields = fetch()
+    write_json(path, {'fetched': time.time(), 'fields': fields})
+    return fields
+
+
+class IssueCache(object):
+    """On-disk store of the raw JSON of the issues returned by one query,
+    keyed by issue key.
+
+    The `watermark` is the most recent `updated` timestamp seen, so that
+    later runs only need to fetch issues updated since then and `merge`
+    them in.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = None
+        self.issues = {}
+        self.load()
+
+    @classmethod
+    def for_query(cls, directory, *parts):
+        return cls(os.path.join(directory, 'issues-%s.json' % cache_name(*parts)))
+
+    def load(self):
+        data = read_json(self.path)
+        if data is None:
+            return
+        self.watermark = data.get('watermark')
+        self.issues = data.get('issues', {})
+
+    def save(self):
+        write_json(self.path, {'watermark': self.watermark, 'issues': self.issues})
+
+    def merge(self, raw_issues):
+        """Add or replace issues, keeping the latest `updated` timestamp as
+        the new watermark.
+        """
+        for raw in raw_issues:
+            self.issues[raw['key']] = raw
+            updated = raw.get('fields', {}).get('updated')
+            if updated is not None and (self.watermark is None or parse_updated(updated) > parse_updated(self.watermark)):
+                self.watermark = updated
+
+    def retain(self, keys):
+        """Drop any issue whose key is not in `keys`, e.g. because it has
+        been deleted or no longer matches the query.
+        """
+        keys = set(keys)
+        for key in list(self.issues.keys()):
+            if key not in keys:
+                del self.issues[key]
+
+    def since_jql(self):
+        """Return a JQL clause selecting issues updated since the watermark.
+
+        JQL dates are interpreted in the time zone of the JIRA user, so we go
+        back a day from the watermark to be safe: issues fetched twice are
+        simply merged again.
+        """
+        if self.watermark is None:
+            return None
+        since = parse_updated(self.watermark) - datetime.timedelta(days=1)
+        return 'updated >= "%s"' % since.strftime('%Y/%m/%d')
+
+
+def parse_updated(value):
+    """Parse the date part of a JIRA `updated` timestamp for comparisons
+    """
+    return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
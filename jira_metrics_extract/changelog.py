@@ -0,0 +1,100 @@
+import dateutil.tz
+
+from .timestamps import parse_timestamp
+
+STATUS = 'status'
+RESOLUTION = 'resolution'
+SIZE = 'Story Points'
+
+
+class ChangelogEvents(object):
+    """The status, resolution and size changes of one issue, in the order
+    they happened, as parallel lists:
+
+    * `dates`: when the change was made, in UTC
+    * `fields`: which field changed (`STATUS`, `RESOLUTION` or the size field)
+    * `values`: the new value (`toString`)
+    * `resolved`: whether the issue was resolved after the change
+
+    `created` is the creation date of the issue, and `initial_status` and
+    `initial_size` are its status and size at that time.
+    """
+
+    def __init__(self, key, created, initial_status, initial_size):
+        self.key = key
+        self.created = created
+        self.initial_status = initial_status
+        self.initial_size = initial_size
+
+        self.dates = []
+        self.fields = []
+        self.values = []
+        self.resolved = []
+
+    def __len__(self):
+        return len(self.dates)
+
+
+def decode_changelog(issue, size_field=SIZE, current_size=None):
+    """Decode the changelog of a raw issue in a single pass, parsing each
+    history timestamp once.
+
+    `current_size` is used as the initial size if the size never changed.
+    Returns None if the issue was fetched without its changelog.
+    """
+
+    try:
+        histories = issue['changelog']['histories']
+    except KeyError:
+        return None
+
+    fields = issue['fields']
+    events = ChangelogEvents(
+        key=issue['key'],
+        created=parse_timestamp(fields['created']).astimezone(dateutil.tz.tzutc()),
+        initial_status=None,
+        initial_size=None
+    )
+
+    first_status = None
+    first_size = None
+    is_resolved = False
+
+    for change in histories:
+        change_date = None
+        start = len(events.dates)
+        resolution_to = None
+        has_resolution = False
+
+        for item in change['items']:
+            field = item['field']
+            if field != STATUS and field != RESOLUTION and field != size_field:
+                continue
+
+            if change_date is None:
+                change_date = parse_timestamp(change['created']).astimezone(dateutil.tz.tzutc())
+
+            if field == STATUS:
+                if first_status is None:
+                    first_status = item
+            elif field == RESOLUTION:
+                has_resolution = True
+                resolution_to = item['to']
+            elif first_size is None:
+                first_size = item
+
+            events.dates.append(change_date)
+            events.fields.append(field)
+            events.values.append(item['toString'])
+            events.resolved.append(is_resolved)
+
+        # The resolution state after a change applies to all its items
+        if has_resolution:
+            is_resolved = resolution_to is not None
+            for i in range(start, len(events.resolved)):
+                events.resolved[i] = is_resolved
+
+    events.initial_status = first_status['fromString'] if first_status is not None else fields['status']['name']
+    events.initial_size = first_size['fromString'] if first_size is not None else current_size
+
+    return events
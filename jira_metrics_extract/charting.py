@@ -15,6 +15,8 @@ except ImportError:
 import datetime
 
 from .cycletime import CycleTimeQueries
+from .montecarlo import DEFAULT_MAX_TRIALS
+from .arrays import rightmost_index
 
 class UnchartableData(Exception):
     """Thrown when data does not support the required chart
@@ -269,7 +271,22 @@ def burnup_forecast(
     deadline=None, deadline_confidence=None,
     title=None,
     ax=None,
-    sized=''):
+    sized='',
+    envelope=None,
+    seed=None,
+    processes=None,
+    tolerance=None,
+    max_trials=DEFAULT_MAX_TRIALS):
+    """Draw a burn-up chart with a Monte Carlo forecast to completion. By
+    default every trial is drawn as a faint line; give `envelope` as a list
+    of percentiles (e.g. `[0.05, 0.5, 0.95]`) to draw those percentiles
+    across trials, shading between the lowest and highest, instead. Give a
+    `seed` for a repeatable simulation: the same seed gives the same trials
+    as `CycleTimeQueries.burnup_forecast()`. The trials may be split across
+    `processes`. With a `tolerance`, `trials` is the size of a batch and
+    batches are run until the `percentiles` settle, up to `max_trials` (see
+    `CycleTimeQueries.settle_trials()`).
+    """
 
     if len(cfd_data.index) == 0:
         raise UnchartableData("Cannot draw burnup forecast chart with no data")
@@ -321,25 +338,54 @@ def burnup_forecast(
     # end debug
     plot_data.plot.line(ax=ax, legend=False)
     
-    mc_trials = CycleTimeQueries.burnup_monte_carlo(
-        start_value=cfd_data[done_column+sized].max(),
-        target_value=target,
-        start_date=cfd_data.index.max(),
-        throughput_data=throughput_data,
-        trials=trials
-    )
-    
     deadline_confidence_date = None
+    finish_dates = None
+
+    if envelope:
+        # Draw percentile bands across the trials rather than every trial
+        simulation = CycleTimeQueries.burnup_finish_dates(
+            start_value=cfd_data[done_column+sized].max(),
+            target_value=target,
+            start_date=cfd_data.index.max(),
+            throughput_data=throughput_data,
+            trials=trials,
+            band_percentiles=sorted(envelope),
+            seed=seed,
+            processes=processes,
+            tolerance=tolerance,
+            percentiles=percentiles,
+            max_trials=max_trials
+        )
 
-    if mc_trials is not None:
+        if simulation is not None:
+            finish_dates, bands = simulation
 
-        for col in mc_trials:
-            mc_trials[col][mc_trials[col] > target] = target
+            ax.fill_between(bands.index, bands.iloc[:, 0], bands.iloc[:, -1], color='#ff9696', alpha=0.3, linewidth=0)
+            bands.plot.line(ax=ax, legend=False, color='#ff9696', linestyle='solid', linewidth=0.5)
+    else:
+        mc_trials = CycleTimeQueries.burnup_monte_carlo(
+            start_value=cfd_data[done_column+sized].max(),
+            target_value=target,
+            start_date=cfd_data.index.max(),
+            throughput_data=throughput_data,
+            trials=trials,
+            seed=seed,
+            processes=processes,
+            tolerance=tolerance,
+            percentiles=percentiles,
+            max_trials=max_trials
+        )
 
-        mc_trials.plot.line(ax=ax, legend=False, color='#ff9696', linestyle='solid', linewidth=0.1)
+        if mc_trials is not None:
+            mc_trials = np.minimum(mc_trials, target)
+
+            mc_trials.plot.line(ax=ax, legend=False, color='#ff9696', linestyle='solid', linewidth=0.1)
+
+            # percentiles at finish line
+            finish_dates = mc_trials.apply(pd.Series.last_valid_index)
+
+    if finish_dates is not None:
 
-        # percentiles at finish line
-        finish_dates = mc_trials.apply(pd.Series.last_valid_index)
         finish_date_percentiles = finish_dates.quantile(percentiles).dt.normalize()
         
         # percentile at deadline confidence interval
@@ -460,12 +506,6 @@ def ageing_wip_chart(cycle_data, start_column, end_column, done_column=None, now
         cycle_data.ix[:, start_column:end_column]
     ), axis=1)
 
-    def extract_status(row):
-        last_valid = row.last_valid_index()
-        if last_valid is None:
-            return np.NaN
-        return last_valid
-
     def extract_age(row):
         started = row[start_column]
         if pd.isnull(started):
@@ -473,7 +513,12 @@ def ageing_wip_chart(cycle_data, start_column, end_column, done_column=None, now
         return (today - started.date()).days
 
     wip_data = cycle_data[['key', 'summary']].copy()
-    wip_data['status'] = cycle_data.apply(extract_status, axis=1)
+    # The furthest state each item has reached
+    status_columns = cycle_data.columns[2:]
+    if len(status_columns) == 0:
+        raise UnchartableData("Need at least one status column")
+    furthest = rightmost_index(cycle_data[status_columns].notnull().values)
+    wip_data['status'] = np.where(furthest >= 0, np.asarray(status_columns, dtype=object)[furthest], np.nan)
     wip_data['age'] = cycle_data.apply(extract_age, axis=1)
 
     wip_data.dropna(how='any', inplace=True)
@@ -20,6 +20,8 @@ JIRAError.log_to_tempfile = False
 
 from .config import config_to_options
 from .cycletime import CycleTimeQueries
+from .query import IncompleteResults
+from .montecarlo import DEFAULT_MAX_TRIALS
 from . import charting
 
 # dateparser module uses the load stream function in a way that is not save. But as this is an dependent module we will ignore warning at present.
@@ -39,6 +41,8 @@ def create_argument_parser():
     parser.add_argument('output', metavar='data.csv', nargs='?', help='Output file. Contains all issues described by the configuration file, metadata, and dates of entry to each state in the cycle.')
     parser.add_argument('-v', dest='verbose', action='store_true', help='Verbose output')
     parser.add_argument('-n', metavar='N', dest='max_results', type=int, help='Only fetch N most recently updated issues',default=500)
+    parser.add_argument('-j', metavar='N', dest='fetch_concurrency', type=int, help='Fetch up to N pages of issues from JIRA at the same time')
+    parser.add_argument('--raw-json', dest='raw_json', action='store_true', help='Read issues from JIRA as plain JSON instead of building jira library objects. Faster on large extracts.')
     parser.add_argument('-b', dest='blankcredentials', action='store_true',help='Flag to set username and password to empty strings.')
     parser.add_argument('--changelog', dest='changelog', action='store_true',help='Get issue history changelog. Default for all queries.')
     parser.add_argument('--no-changelog', dest='changelog', action='store_false',help='DO NOT Get issue history changelog. Limit response size.')
@@ -52,9 +56,14 @@ def create_argument_parser():
     parser.add_argument('--throughput', metavar='throughput.csv', help='Calculate daily throughput data and write to file. Hint: Plot as a column chart.')
     parser.add_argument('--percentiles', metavar='percentiles.csv', help='Calculate cycle time percentiles and write to file.')
     parser.add_argument('--burnup-forecast', metavar='burnup_forecast.csv', help='Calculate forecasted dates percentiles and write to file.')
+    parser.add_argument('--seed', metavar='1234', type=int, help='Seed for the Monte Carlo simulations, to make forecasts repeatable.')
+    parser.add_argument('--burnup-forecast-tolerance', metavar='0.5', type=float, help='Run Monte Carlo trials for --burnup-forecast and --charts-burnup-forecast in batches until the forecast dates move by no more than this many periods of throughput (days for daily throughput).')
+    parser.add_argument('--burnup-forecast-max-trials', metavar='100000', type=int, default=DEFAULT_MAX_TRIALS, help='Most Monte Carlo trials to run with --burnup-forecast-tolerance.')
+    parser.add_argument('--processes', metavar='4', type=int, help='Split the Monte Carlo simulations for --burnup-forecast and --charts-burnup-forecast across this many processes (0 for one per CPU core).')
     parser.add_argument('--size-history', metavar='size_history.csv',
                         help='Get Story Points history and write to file.')
     parser.add_argument('--links', metavar='links_data.tsv', help='Write issue links and epic relationships to file.')
+    parser.add_argument('--cfd-trace', metavar='cfd_trace.tsv', help='With --points, write the furthest state and size of each issue on each day of the CFD to file, for debugging.')
 
     parser.add_argument('--quantiles', metavar='0.3,0.5,0.75,0.85,0.95', help="Quantiles to use when calculating percentiles")
     parser.add_argument('--backlog-column', metavar='<name>', help="Name of the backlog column. Defaults to the first column.")
@@ -91,6 +100,7 @@ def create_argument_parser():
         parser.add_argument('--charts-burnup-forecast-deadline', metavar=datetime.date.today().isoformat(), help="Deadline date for completion of backlog. If set, it will be shown on the chart, and the forecast delta will also be shown.")
         parser.add_argument('--charts-burnup-forecast-deadline-confidence', metavar=.85, type=float, help="Quantile to use when comparing deadline to forecast.")
         parser.add_argument('--charts-burnup-forecast-trials', metavar='100', type=int, default=100, help="Number of iterations in Monte Carlo simulation.")
+        parser.add_argument('--charts-burnup-forecast-envelope', metavar='0.05,0.5,0.95', help="Draw these percentiles across Monte Carlo trials, rather than every trial.")
 
         parser.add_argument('--charts-wip', metavar='wip', help="Draw weekly WIP box plot")
         parser.add_argument('--charts-wip-title', metavar='"Weekly WIP"', help="Title for WIP chart")
@@ -177,6 +187,15 @@ def main(argv=None):
     if args.max_results is not None:
         options['settings']['max_results'] = args.max_results
 
+    if args.fetch_concurrency is not None:
+        options['settings']['fetch_concurrency'] = args.fetch_concurrency
+
+    if args.raw_json:
+        options['settings']['raw_json'] = True
+
+    if args.cfd_trace:
+        options['settings']['cfd_trace'] = args.cfd_trace
+
     if getattr(args,'quantiles',None) is not None:
         try:
             quantiles = [float(s.strip()) for s in args.quantiles.split(',')]
@@ -218,11 +237,11 @@ def main(argv=None):
 
         if args.points and args.changelog:
             print("Working out size changes of issues over time")
-            df_size_history = q.size_history(size_data)
-            df_size_history.to_csv(r'size_history.csv', sep=output_separator, encoding='utf-8')  # Save to file.
+            size_history = q.size_store(size_data)
+            size_history.to_frame().to_csv(r'size_history.csv', sep=output_separator, encoding='utf-8')  # Save to file.
         else:
-            df_size_history = None
-    except JIRAError as e:
+            size_history = None
+    except (JIRAError, IncompleteResults) as e:
         eprint(e)
         return 1
 
@@ -231,8 +250,7 @@ def main(argv=None):
 
     #cfd_data = q.cfd(cycle_data)
     print("Working out CFD data")
-    cfd_data = q.cfd(cycle_data, size_history = df_size_history, pointscolumn=args.points, stacked=False)
-    cfd_data_stackable = q.cfd(cycle_data, size_history = df_size_history, pointscolumn=args.points, stacked=True)
+    cfd_data, cfd_data_stackable = q.cfd_tables(cycle_data, size_history = size_history, pointscolumn=args.points)
 
     scatter_data = q.scatterplot(cycle_data)
     histogram_data = q.histogram(cycle_data)
@@ -304,7 +322,11 @@ def main(argv=None):
                 backlog_column=backlog_column,
                 done_column=done_column,
                 percentiles=quantiles,
-                sized='Sized')
+                sized='Sized',
+                seed=args.seed,
+                processes=args.processes,
+                tolerance=args.burnup_forecast_tolerance,
+                max_trials=args.burnup_forecast_max_trials)
         else:
             burnup_forecast_data = q.burnup_forecast(
                 cfd_data,
@@ -314,7 +336,11 @@ def main(argv=None):
                 backlog_column=backlog_column,
                 done_column=done_column,
                 percentiles=quantiles,
-                sized='')
+                sized='',
+                seed=args.seed,
+                processes=args.processes,
+                tolerance=args.burnup_forecast_tolerance,
+                max_trials=args.burnup_forecast_max_trials)
 
     except Exception as e:
         print("Warning: Failed to calculate burnup forecast data")
@@ -561,6 +587,13 @@ def main(argv=None):
             deadline = parse_relative_date(args.charts_burnup_forecast_deadline) if args.charts_burnup_forecast_deadline else None
             deadline_confidence = args.charts_burnup_forecast_deadline_confidence
 
+            envelope = None
+            if args.charts_burnup_forecast_envelope:
+                try:
+                    envelope = [float(s.strip()) for s in args.charts_burnup_forecast_envelope.split(',')]
+                except ValueError:
+                    print("Invalid value for --charts-burnup-forecast-envelope: " + args.charts_burnup_forecast_envelope)
+
             print("Drawing burnup forecast chart in", args.charts_burnup_forecast)
             charting.set_style('whitegrid')
             try:
@@ -576,7 +609,12 @@ def main(argv=None):
                         deadline=deadline,
                         deadline_confidence=deadline_confidence,
                         title=args.charts_burnup_forecast_title,
-                        sized='Sized'
+                        sized='Sized',
+                        envelope=envelope,
+                        seed=args.seed,
+                        processes=args.processes,
+                        tolerance=args.burnup_forecast_tolerance,
+                        max_trials=args.burnup_forecast_max_trials
                     )
                 else:
                     ax = charting.burnup_forecast(
@@ -590,7 +628,12 @@ def main(argv=None):
                         deadline=deadline,
                         deadline_confidence=deadline_confidence,
                         title=args.charts_burnup_forecast_title,
-                        sized=''
+                        sized='',
+                        envelope=envelope,
+                        seed=args.seed,
+                        processes=args.processes,
+                        tolerance=args.burnup_forecast_tolerance,
+                        max_trials=args.burnup_forecast_max_trials
                     )
             except charting.UnchartableData as e:
                 print("** WARNING: Did not draw chart:", e)
@@ -598,12 +641,16 @@ def main(argv=None):
                 fig = ax.get_figure()
                 fig.savefig(args.charts_burnup_forecast, bbox_inches='tight', dpi=300)
 
+        # Daily counts of issues in each state, for the WIP and net flow charts
+        if args.charts_wip or args.charts_net_flow:
+            flow_data = q.flow_tables(cycle_data)[0]
+
         if args.charts_wip:
             print("Drawing WIP chart in", args.charts_wip)
             charting.set_style('darkgrid')
             try:
                 ax = charting.wip_chart(
-                    q.cfd(cycle_data[cycle_data[backlog_column] >= (datetime.date.today() - datetime.timedelta(weeks=(args.charts_wip_window or 6)))]),
+                    flow_data[flow_data.index >= pd.Timestamp(datetime.date.today() - datetime.timedelta(weeks=(args.charts_wip_window or 6)))],
                     start_column=committed_column,
                     end_column=final_column,
                     title=args.charts_wip_title
@@ -636,7 +683,7 @@ def main(argv=None):
             charting.set_style('darkgrid')
             try:
                 ax = charting.net_flow_chart(
-                    q.cfd(cycle_data[cycle_data[backlog_column] >= (datetime.date.today() - datetime.timedelta(weeks=(args.charts_net_flow_window or 6)))]),
+                    flow_data[flow_data.index >= pd.Timestamp(datetime.date.today() - datetime.timedelta(weeks=(args.charts_net_flow_window or 6)))],
                     start_column=committed_column,
                     end_column=done_column,
                     title=args.charts_net_flow_title
@@ -0,0 +1,142 @@
+from past.builtins import basestring
+import collections
+import datetime
+
+import dateutil.tz
+import numpy as np
+import pandas as pd
+
+from .timestamps import parse_timestamp
+
+# Kinds of column
+OBJECT = 'object'
+INTEGER = 'integer'
+CATEGORY = 'category'
+DATETIME = 'datetime'
+TIMEDELTA = 'timedelta'
+
+# The int64 value numpy uses for NaT
+NAT = np.iinfo(np.int64).min
+
+EPOCH = datetime.datetime(1970, 1, 1)
+UTC = dateutil.tz.tzutc()
+
+
+def timedelta_ns(delta):
+    """Return a timedelta as a whole number of nanoseconds
+    """
+    return ((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds) * 1000
+
+
+def datetime_ns(value):
+    """Return a datetime (or a string holding one) as nanoseconds since the
+    epoch. Time zone aware datetimes are converted to UTC; naive ones are
+    taken as they are.
+    """
+    if isinstance(value, basestring):
+        value = parse_timestamp(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(UTC).replace(tzinfo=None)
+    return timedelta_ns(value - EPOCH)
+
+
+class ColumnarBuilder(object):
+    """Build a DataFrame a row at a time, storing each column in a numpy
+    array that grows as needed.
+
+    Initialise with a list of `(name, kind)` pairs, where kind is one of:
+
+    * `OBJECT`: any Python value
+    * `INTEGER`: an integer, stored as int64 (missing values are 0)
+    * `CATEGORY`: a hashable value, stored as an integer code
+    * `DATETIME`: a datetime, stored as int64 nanoseconds since the epoch
+    * `TIMEDELTA`: a timedelta, stored as int64 nanoseconds
+
+    Missing values (`None`) become `None`, NaN or NaT as appropriate.
+    """
+
+    def __init__(self, columns, capacity=1024):
+        self.kinds = collections.OrderedDict(columns)
+        self.size = 0
+        self.capacity = max(capacity, 1)
+
+        self.arrays = {}
+        self.codes = {}
+        self.categories = {}
+
+        for name, kind in self.kinds.items():
+            self.arrays[name] = self._allocate(kind, self.capacity)
+            if kind == CATEGORY:
+                self.codes[name] = {}
+                self.categories[name] = []
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _allocate(kind, capacity):
+        if kind == DATETIME or kind == TIMEDELTA:
+            return np.full(capacity, NAT, dtype=np.int64)
+        if kind == CATEGORY:
+            return np.full(capacity, -1, dtype=np.int32)
+        if kind == INTEGER:
+            return np.zeros(capacity, dtype=np.int64)
+        return np.full(capacity, None, dtype=object)
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        for name, kind in self.kinds.items():
+            array = self._allocate(kind, capacity)
+            array[:self.size] = self.arrays[name][:self.size]
+            self.arrays[name] = array
+        self.capacity = capacity
+
+    def append(self, row):
+        """Add a row, given as a dict. Keys that are not columns are ignored.
+        """
+        if self.size == self.capacity:
+            self._grow()
+
+        i = self.size
+        for name, kind in self.kinds.items():
+            value = row.get(name)
+            if value is None:
+                continue
+
+            if kind == DATETIME:
+                self.arrays[name][i] = datetime_ns(value)
+            elif kind == TIMEDELTA:
+                self.arrays[name][i] = timedelta_ns(value)
+            elif kind == CATEGORY:
+                codes = self.codes[name]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(self.categories[name])
+                    self.categories[name].append(value)
+                self.arrays[name][i] = code
+            else:
+                self.arrays[name][i] = value
+
+        self.size += 1
+
+    def column(self, name):
+        """Return the data of a column as a numpy array or Categorical
+        """
+        kind = self.kinds[name]
+        data = self.arrays[name][:self.size]
+
+        if kind == DATETIME:
+            return data.view('datetime64[ns]')
+        if kind == TIMEDELTA:
+            return data.view('timedelta64[ns]')
+        if kind == CATEGORY:
+            return pd.Categorical.from_codes(data, self.categories[name])
+        return data
+
+    def to_frame(self, columns=None):
+        """Return a DataFrame of the given columns (by default, all of them
+        in the order they were declared).
+        """
+        if columns is None:
+            columns = list(self.kinds.keys())
+        return pd.DataFrame(collections.OrderedDict((name, self.column(name)) for name in columns), columns=columns)
@@ -44,6 +44,9 @@ def config_to_options(data):
             'cycle': [],
 
             'max_results': 500,
+            'fetch_concurrency': 1,
+            'raw_json': False,
+            'cfd_trace': None,
             'quantiles': [0.3, 0.5, 0.75, 0.85, 0.95],
             'charts_from': None,
             'charts_to': None
@@ -58,7 +61,7 @@ def config_to_options(data):
     if 'domain' not in options['connection']:
         raise ConfigError("No `Domain` set in the `Connection` section")
 
-    # Cach Jira query to file?
+    # Cache Jira issues to disk between runs?
     if 'Cache Jira' in config:
         options['settings']['cache_jira'] = config['Cache Jira']
     else:
@@ -135,6 +138,14 @@ def config_to_options(data):
 
     if 'max results' in config:
         options['settings']['max_results'] = config['max results']
+    if 'fetch concurrency' in config:
+        options['settings']['fetch_concurrency'] = int(config['fetch concurrency'])
+    if 'fields cache ttl' in config:
+        options['settings']['fields_cache_ttl'] = int(config['fields cache ttl'])
+    if 'raw json' in config:
+        options['settings']['raw_json'] = bool(config['raw json'])
+    if 'cfd trace' in config:
+        options['settings']['cfd_trace'] = config['cfd trace']
     if 'quantiles' in config:
         options['settings']['quantiles'] = force_list(config['quantiles'])
     if 'charts from' in config:
@@ -1,13 +1,17 @@
-from .query import QueryManager
+from .query import QueryManager, raw_issue
+from .changelog import STATUS, SIZE
+from .timestamps import parse_timestamp
+from .columnar import ColumnarBuilder, OBJECT, INTEGER, CATEGORY, DATETIME, TIMEDELTA, datetime_ns
+from .arrays import floor_days, group_ids, grouped_shift, rightmost_index
+from .sizes import SizeHistory, size_history_frame
+from .montecarlo import DEFAULT_MAX_TRIALS, TRIALS_PER_CHUNK, adaptive_simulate, bands_frame, finish_dates, parallel_simulate, parallel_simulate_bands, random_seed, segment_simulation, step_dates, steps_until, throughput_values, trials_frame
+from .flow import NEVER, CfdTrace, cumulative_flows, daily_frame, entry_days, event_days, flow_sizes
 import pandas as pd
 import numpy as np
 import os
-import dateutil.parser
 import datetime
 import csv
 import pytz
-import tempfile
-from functools import reduce
 import sys
 
 class StatusTypes:
@@ -55,7 +59,8 @@ class CycleTimeQueries(QueryManager):
                 "type": StatusTypes.complete,
                 "statuses": ["Done", "Closed"],
             },
-        ]
+        ],
+        cfd_trace=None,  # file to trace the data behind a sized CFD to; see CfdTrace
     )
 
     def __init__(self, jira, **kwargs):
@@ -110,6 +115,9 @@ class CycleTimeQueries(QueryManager):
         If an item moves backwards through the cycle, subsequent date/time
         stamps in the cycle are erased.
 
+        Issues are fetched from JIRA a page at a time, and each issue is
+        discarded once its rows have been recorded. The changelog of each
+        issue is decoded once, yielding both its status and size changes.
 
         """
 
@@ -117,76 +125,82 @@ class CycleTimeQueries(QueryManager):
         accepted_steps = set(s['name'] for s in self.settings['cycle'] if s['type'] == StatusTypes.accepted)
         completed_steps = set(s['name'] for s in self.settings['cycle'] if s['type'] == StatusTypes.complete)
 
-        series = {
-            'key': {'data': [], 'dtype': str},
-            'url': {'data': [], 'dtype': str},
-            'issue_type': {'data': [], 'dtype': str},
-            'summary': {'data': [], 'dtype': str},
-            'status': {'data': [], 'dtype': str},
-            'resolution': {'data': [], 'dtype': str},
-            'cycle_time': {'data': [], 'dtype': 'timedelta64[ns]'},
-            'completed_timestamp': {'data': [], 'dtype': 'datetime64[ns]'},
-            'created_timestamp': {'data': [], 'dtype': 'datetime64[ns]'}
-        }
-
-        if sys.platform.startswith('win'):
-            buffer = open("cycledata.tmp", "w+",1)
-            # Opens a file for writing only in binary format. Overwrites the file if the file exists.
-            # buffering value is 1
-            # Windows users seem to have a problem with spooled file
-        else:
-            buffer = tempfile.SpooledTemporaryFile(max_size=50000, mode='w+t')
+        result_columns = (
+            ['key', 'url', 'issue_type', 'summary', 'status', 'resolution'] +
+            sorted(self.fields.keys()) +
+            ([self.settings['query_attribute']] if self.settings['query_attribute'] else []) +
+            ['cycle_time', 'completed_timestamp'] +
+            cycle_names
+        )
 
-        #issuelinks = open("issuelinks.csv", "w+", 1)
-        #df_edges = pd.DataFrame()
-        #df_edges = pd.DataFrame(columns=['Source', 'OutwardLink', 'Target', 'Inwardlink','LinkType'])
-        #df_edges.to_csv(issuelinks, columns=['Source', 'OutwardLink', 'Target', 'Inwardlink','LinkType'], header=True, index=None, sep='\t',encoding='utf-8')
+        # Columns are stored as typed arrays as issues are read; see ColumnarBuilder
+        column_kinds = {
+            'issue_type': CATEGORY,
+            'status': CATEGORY,
+            'resolution': CATEGORY,
+            'cycle_time': TIMEDELTA,
+            'completed_timestamp': DATETIME,
+        }
+        for cycle_name in cycle_names:
+            column_kinds[cycle_name] = DATETIME
 
-        df_size_history = pd.DataFrame( columns=['key','fromDate','toDate','size'])
-        df_size_history.to_csv(buffer, columns=['key', 'fromDate', 'toDate', 'size'], header=True, index=None, sep='\t',encoding='utf-8')
+        builder = ColumnarBuilder([(name, column_kinds.get(name, OBJECT)) for name in result_columns])
 
-        for cycle_name in cycle_names:
-            series[cycle_name] = {'data': [], 'dtype': 'datetime64[ns]'}
+        # Issue links, as tuples in the order of `edge_columns`. A link is seen
+        # from both of the issues it links, but only recorded once.
+        edge_columns = ['Source', 'OutwardLink', 'Target', 'InwardLink', 'LinkType', 'LinkID']
+        edges = []
+        seen_links = set()
 
-        for name in self.fields.keys():
-            series[name] = {'data': [], 'dtype': 'object'}
+        # Size changes of each issue: its position in the issue's history, and
+        # the size from that date. The end dates are worked out at the end.
+        size_builder = ColumnarBuilder([
+            ('position', INTEGER),
+            ('key', CATEGORY),
+            ('fromDate', DATETIME),
+            ('size', OBJECT),
+        ])
 
-        if self.settings['query_attribute']:
-            series[self.settings['query_attribute']] = {'data': [], 'dtype': str}
+        # Compiled in resolve_fields(); see QueryManager.resolve_field_value()
+        field_resolvers = [(name, field_name, self.field_resolvers[name]) for name, field_name in self.fields.items()]
 
         for criteria in self.settings['queries']:
-            for issue in self.find_issues(criteria, order='updatedDate DESC', verbose=verbose, changelog=changelog):
+            # Stream issues so that only the current page of raw issues is kept in memory
+            for issue in self.iter_issues(criteria, order='updatedDate DESC', verbose=verbose, changelog=changelog):
+                issue = raw_issue(issue)
+                issue_key = issue['key']
+                fields = issue['fields']
 
                 # Deal with the differences in strings between Python 2 & 3
                 if (sys.version_info > (3, 0)):
                     # Python 3 code in this block
                     item = {
-                        'key': issue.key,
-                        'url': "%s/browse/%s" % (self.jira._options['server'], issue.key,),
-                        'issue_type': issue.fields.issuetype.name,
-                        'summary': issue.fields.summary,  # .encode('utf-8'),
-                        'status': issue.fields.status.name,
-                        'resolution': issue.fields.resolution.name if issue.fields.resolution else None,
+                        'key': issue_key,
+                        'url': "%s/browse/%s" % (self.jira._options['server'], issue_key,),
+                        'issue_type': fields['issuetype']['name'],
+                        'summary': fields['summary'],  # .encode('utf-8'),
+                        'status': fields['status']['name'],
+                        'resolution': fields['resolution']['name'] if fields['resolution'] else None,
                         'cycle_time': None,
                         'completed_timestamp': None,
-                        'created_timestamp':  issue.fields.created[:19]
+                        'created_timestamp':  fields['created'][:19]
                     }
                 else:
                     # Python 2 code in this block
                     item = {
-                        'key': issue.key,
-                        'url': "%s/browse/%s" % (self.jira._options['server'], issue.key,),
-                        'issue_type': issue.fields.issuetype.name,
-                        'summary': issue.fields.summary.encode('utf-8'),
-                        'status': issue.fields.status.name,
-                        'resolution': issue.fields.resolution.name if issue.fields.resolution else None,
+                        'key': issue_key,
+                        'url': "%s/browse/%s" % (self.jira._options['server'], issue_key,),
+                        'issue_type': fields['issuetype']['name'],
+                        'summary': fields['summary'].encode('utf-8'),
+                        'status': fields['status']['name'],
+                        'resolution': fields['resolution']['name'] if fields['resolution'] else None,
                         'cycle_time': None,
                         'completed_timestamp': None,
-                        'created_timestamp': issue.fields.created[:19]
+                        'created_timestamp': fields['created'][:19]
                     }
 
-                for name, field_name in self.fields.items():
-                    item[name] = self.resolve_field_value(issue, name, field_name)
+                for name, field_name, resolve in field_resolvers:
+                    item[name] = resolve(fields.get(field_name))
 
                 if self.settings['query_attribute']:
                     item[self.settings['query_attribute']] = criteria.get('value', None)
@@ -195,8 +209,7 @@ class CycleTimeQueries(QueryManager):
                     item[cycle_name] = None
 
                 # Get the relationships for this issue
-                edges = []  # Source, Target, Inward Link, Outward Link, Type
-                issuelinks = issue.fields.issuelinks
+                issuelinks = fields['issuelinks']
 
                 # It is seems that having an Epic Parent does not record an Epic Link, just the name "Epic Name"
                 # Creating Epic relationship requires more work. Also each Jira instance will have different customfields for Epic data
@@ -207,80 +220,72 @@ class CycleTimeQueries(QueryManager):
                 #    edges.append(data)
 
                 for link in issuelinks:
+                    if link['id'] in seen_links:
+                        continue
+                    seen_links.add(link['id'])
+
                     inwardissue = None
                     outwardissue = None
                     try:
-                        inwardissue = link.inwardIssue.key
-                    except:
-                        outwardissue = link.outwardIssue.key
+                        inwardissue = link['inwardIssue']['key']
+                    except KeyError:
+                        outwardissue = link['outwardIssue']['key']
 
                     if inwardissue is not None:
-                        data = {'LinkID':link.id,'Source':inwardissue, 'Target':issue.key, 'InwardLink':link.type.inward, 'OutwardLink': link.type.outward, 'LinkType':link.type.name}
-                    else:
-                        data = {'LinkID':link.id,'Source':issue.key, 'Target': outwardissue, 'InwardLink':link.type.inward, 'OutwardLink':link.type.outward, 'LinkType':link.type.name}
-                    edges.append(data)
-
-                if len(edges)>0:
-                    try:
-                        df_edges
-                    except NameError:
-                        #print('Not found')
-                        df_edges = pd.DataFrame(edges)
+                        source, target = inwardissue, issue_key
                     else:
-                        df_links = pd.DataFrame(edges)
-                        df_edges=df_edges.append(df_links)  # = pd.DataFrame(edges)
+                        source, target = issue_key, outwardissue
+                    edges.append((source, link['type']['outward'], target, link['type']['inward'], link['type']['name'], link['id']))
                 # Got all the relationships for this issue
 
-                rows = []
-                try:
-                    for snapshot in self.iter_size_changes(issue):
-                        data= {'key':snapshot.key,'fromDate':snapshot.date,'size':snapshot.size}
-                        rows.append(data)
-
-                    df = pd.DataFrame(rows)
-                    # Create the toDate column
-                    df_toDate=df['fromDate'].shift(-1)
-                    df_toDate.loc[len(df_toDate)-1] = datetime.datetime.now(pytz.utc)
-                    df['toDate'] = df_toDate
-                except:
-                    df = pd.DataFrame(columns = ['key', 'fromDate', 'toDate', 'size'])
-
-                # Round Down datetimes to full dates
-                df['fromDate'] = df['fromDate'].apply(lambda dt: datetime.datetime(dt.year, dt.month, dt.day))
-                df['toDate'] = df['toDate'].apply(lambda dt: datetime.datetime(dt.year, dt.month, dt.day))
-                # If we only have one row of size changes and current issue has a size then it must have been created with a size value at creation.
-                # This size will not be recorded in the size_change record.
-                # Hence update the single row we have with the current issue size.
-                # Get Story Points size changes history
-                #If condition is met update the size cell
-                if getattr(item, 'StoryPoints', None) is not None and (df.shape[0]==1):
-                #if (item['StoryPoints'] is not None ) and (len(df)==1):
-                    df.loc[df.index[0], 'size'] = item['StoryPoints']
-
-                # Append to csv file
-                df.to_csv(buffer, columns=['key', 'fromDate', 'toDate', 'size'], header=None,
-                           mode='a', sep='\t', date_format='%Y-%m-%d',encoding='utf-8')
-                #print(rows)
+                # Decode status and size changes in one pass over the changelog
+                changes = self.decode_changelog(issue)
+
+                # Record the size from creation and after each size change, each
+                # size lasting until the next change. An issue created with a size
+                # that never changed has its current size (see decode_changelog()).
+                if changes is not None:
+                    size_dates = [changes.created]
+                    sizes = [changes.initial_size]
+                    for date, field, value in zip(changes.dates, changes.fields, changes.values):
+                        if field == SIZE:
+                            size_dates.append(date)
+                            sizes.append(value)
+
+                    for position, (from_date, size) in enumerate(zip(size_dates, sizes)):
+                        size_builder.append({
+                            'position': position,
+                            'key': issue_key,
+                            'fromDate': from_date,
+                            'size': size,
+                        })
 
                 # If the first column in item lifecycle was scipted put the created data in it.
                 if item[cycle_names[0]] is None:
-                    item[cycle_names[0]] = dateutil.parser.parse(item['created_timestamp']) #item['created_timestamp']
+                    item[cycle_names[0]] = parse_timestamp(item['created_timestamp']) #item['created_timestamp']
                     # Figure out why the first Column does not have created date
                     #print(dateutil.parser.parse(item['created_timestamp']))
 
-                # Record date of status changes
-                for snapshot in self.iter_changes(issue, True):
-                    snapshot_cycle_step = self.settings['cycle_lookup'].get(snapshot.status.lower(), None)
+                # Record date of status changes, starting with the status the issue was created in.
+                # Resolution changes do not change the status, so they do not affect the cycle dates.
+                if changes is not None:
+                    status_changes = [(changes.created, changes.initial_status)] + \
+                        [(date, value) for date, field, value in zip(changes.dates, changes.fields, changes.values) if field == STATUS]
+                else:
+                    status_changes = []
+
+                for change_date, status in status_changes:
+                    snapshot_cycle_step = self.settings['cycle_lookup'].get(status.lower(), None)
                     if snapshot_cycle_step is None:
                         if verbose:
-                            print(issue.key, "transitioned to unknown JIRA status", snapshot.status)
+                            print(issue_key, "transitioned to unknown JIRA status", status)
                         continue
 
                     snapshot_cycle_step_name = snapshot_cycle_step['name']
 
                     # Keep the first time we entered a step
                     if item[snapshot_cycle_step_name] is None:
-                        item[snapshot_cycle_step_name] = snapshot.date
+                        item[snapshot_cycle_step_name] = change_date
 
                     # Wipe any subsequent dates, in case this was a move backwards
                     found_cycle_name = False
@@ -290,7 +295,7 @@ class CycleTimeQueries(QueryManager):
                             continue
                         elif found_cycle_name and item[cycle_name] is not None:
                             if verbose:
-                                print(issue.key, "moved backwards to", snapshot_cycle_step_name, "wiping date for subsequent step", cycle_name)
+                                print(issue_key, "moved backwards to", snapshot_cycle_step_name, "wiping date for subsequent step", cycle_name)
                             item[cycle_name] = None
 
                 # Wipe timestamps if items have moved backwards; calculate cycle time
@@ -312,47 +317,30 @@ class CycleTimeQueries(QueryManager):
                     item['cycle_time'] = completed_timestamp - accepted_timestamp
                     item['completed_timestamp'] = completed_timestamp
 
-                for k, v in item.items():
-                    series[k]['data'].append(v)
-
-        data = {}
-        for k, v in series.items():
-            data[k] = pd.Series(v['data'], dtype=v['dtype'])
+                builder.append(item)
 
-        result_cycle = pd.DataFrame(data,
-                    columns=['key', 'url', 'issue_type', 'summary', 'status', 'resolution'] +
-                    sorted(self.fields.keys()) +
-                    ([self.settings['query_attribute']] if self.settings['query_attribute'] else []) +
-                    ['cycle_time', 'completed_timestamp'] +
-                    cycle_names
-        )
+        result_cycle = builder.to_frame()
 
-        result_size = pd.DataFrame()
-        buffer.seek(0)
-        result_size = result_size.from_csv(buffer, sep='\t')
-        buffer.close()
+        # Each size lasts until the next change to the same issue, or until now.
+        # Round down datetimes to full dates.
+        positions = size_builder.column('position')
+        from_dates = size_builder.column('fromDate')
+        to_dates = grouped_shift(from_dates, group_ids(positions == 0), np.datetime64(datetime_ns(datetime.datetime.now(pytz.utc)), 'ns'))
 
+        result_size = pd.DataFrame({
+            'key': size_builder.column('key'),
+            'fromDate': floor_days(from_dates),
+            'toDate': floor_days(to_dates),
+            'size': size_builder.column('size'),
+        }, index=positions, columns=['key', 'fromDate', 'toDate', 'size'])
         try:
-            df_edges
-        except NameError:
-            # print('Not found')
-            df_edges = pd.DataFrame()
-        try:
-            df_edges = df_edges[['Source', 'OutwardLink', 'Target', 'InwardLink','LinkType','LinkID']] # Specify dataframe sort order
-            #df_edges.to_csv("myedges.csv", sep='\t', index=False,encoding='utf-8')
-        except KeyError:
-            print('Info: No issue edges found.')
+            result_size['size'] = pd.to_numeric(result_size['size'])
+        except (ValueError, TypeError):
+            pass  # leave sizes that are not numbers as they are
 
-        result_edges=df_edges
-
-        # There maybe no result_size data is we might not have any change history
-        try:
-            result_size.set_index('key')
-        except KeyError:
-            result_size = pd.DataFrame(index= ['key'],columns = ['fromDate', 'toDate', 'size'])
-
-        result_size['toDate'] = pd.to_datetime(result_size['toDate'], format=('%Y-%m-%d'))
-        result_size['fromDate'] = pd.to_datetime(result_size['fromDate'], format=('%Y-%m-%d'))
+        if len(edges) == 0:
+            print('Info: No issue edges found.')
+        result_edges = pd.DataFrame.from_records(edges, columns=edge_columns)
 
         return result_cycle, result_size, result_edges
 
@@ -361,50 +349,18 @@ class CycleTimeQueries(QueryManager):
         indexed by day, with columns containing story size for each issue.
 
         In addition, columns are soted by Jira Issue key. First by Project and then by id number.
+
+        See `size_history_frame()`, and `size_store()` for a more compact
+        alternative.
         """
+        return size_history_frame(size_data)
 
-        def my_merge(df1, df2):
-            # http://stackoverflow.com/questions/34411495/pandas-merge-several-dataframes
-            res = pd.merge(df1, df2, how='outer', left_index=True, right_index=True)
-            cols = sorted(res.columns)
-            pairs = []
-            for col1, col2 in zip(cols[:-1], cols[1:]):
-                if col1.endswith('_x') and col2.endswith('_y'):
-                    pairs.append((col1, col2))
-            for col1, col2 in pairs:
-                res[col1[:-2]] = res[col1].combine_first(res[col2])
-                res = res.drop([col1, col2], axis=1)
-            return res
-
-        dfs_key = []
-        # Group the dataframe by regiment, and for each regiment,
-        for name, group in size_data.groupby('key'):
-            dfs = []
-            for row in group.itertuples():
-                # print(row.Index, row.fromDate,row.toDate, row.size)
-                dates = pd.date_range(start=row.fromDate, end=row.toDate)
-                sizes = [row.size] * len(dates)
-                data = {'date': dates, 'size': sizes}
-                df2 = pd.DataFrame(data, columns=['date', 'size'])
-                pd.to_datetime(df2['date'], format=('%Y-%m-%d'))
-                df2.set_index(['date'], inplace=True)
-                dfs.append(df2)
-            # df_final = reduce(lambda left,right: pd.merge(left,right), dfs)
-            df_key = (reduce(my_merge, dfs))
-            df_key.columns = [name if x == 'size' else x for x in df_key.columns]
-            dfs_key.append(df_key)
-        df_all = (reduce(my_merge, dfs_key))
-
-        # Sort the columns based on Jira Project code and issue number
-        mykeys = df_all.columns.values.tolist()
-        mykeys.sort(key=lambda x: x.split('-')[0] + '-' + str(int(x.split('-')[1])).zfill(6))
-        df_all = df_all[mykeys]
-
-        # Reindex to make sure we have all dates
-        start, end = df_all.index.min(), df_all.index.max()
-        df_all = df_all.reindex(pd.date_range(start, end, freq='D'), method='ffill')
-
-        return df_all
+    def size_store(self, size_data):
+        """Return a `SizeHistory` of the size changes in `size_data`, which
+        can be passed to `cfd()` in place of the `size_history()` DataFrame.
+        Its `to_frame()` returns the same DataFrame as `size_history()`.
+        """
+        return SizeHistory(size_data)
 
 
     def cfd(self, cycle_data,size_history= None, pointscolumn= None, stacked = True ):
@@ -418,227 +374,87 @@ class CycleTimeQueries(QueryManager):
 
         If stacked = True then return dataframe suitable for plotting as stacked area chart
         else return for platting as non-staked or line chart.
+
+        `size_history` may be a `SizeHistory` (see `size_store()`) or the
+        DataFrame returned by `size_history()`.
+
+        Both variants are worked out together; see `cfd_tables()`.
         """
+        unstacked_data, stacked_data = self.cfd_tables(cycle_data, size_history=size_history, pointscolumn=pointscolumn)
+        return stacked_data if stacked else unstacked_data
 
-        # Define helper function
-        def cumulativeColumnStates(df,stacked):
-            """
-            Calculate the column sums, were the incoming matrix columns represents items in workflow states
-            States progress from left to right.
-            We what to zero out items, other than right most value to avoid counting items in prior states.
-            :param df:
-            :return: pandas dataframe row with sum of column items
-            """
-
-            # Helper functions to return the right most cells in 2D array
-            def last_number(lst):
-                if all(map(lambda x: x == 0, lst)):
-                    return 0
-                elif lst[-1] != 0:
-                    return len(lst) - 1
-                else:
-                    return last_number(lst[:-1])
-
-            def fill_others(lst):
-                new_lst = [0] * len(lst)
-                new_lst[last_number(lst)] = lst[last_number(lst)]
-                return new_lst
-
-            df_zeroed = df.fillna(value=0)  # ,inplace = True   Get rid of non numeric items. Make a ?deep? copy
-            if stacked:
-                df_result = df_zeroed.apply(lambda x: fill_others(x.values.tolist()), axis=1)
-            else:
-                df_result = df_zeroed
-
-            sum_row = df_result[df.columns].sum()  # Sum Columns
-            return pd.DataFrame(data=sum_row).T  # Transpose into row dataframe and return
-
-        # Helper function to return the right most cells in 2D array
-        def keeprightmoststate(df):
-            """
-            Incoming matrix columns represents items in workflow states
-            States progress from left to right.
-            We what to zero out items, other than right most value.
-            :param df:
-            :return: pandas dataframe row with sum of column items
-            """
-
-            def last_number(lst):
-                if all(map(lambda x: x == 0, lst)):
-                    return 0
-                elif lst[-1] != 0:
-                    return len(lst) - 1
-                else:
-                    return last_number(lst[:-1])
-
-            def fill_others(lst):
-                new_lst = [0] * len(lst)
-                new_lst[last_number(lst)] = lst[last_number(lst)]
-                return new_lst
-
-            df_zeroed = df.fillna(value=0)  # ,inplace = True   Get rid of non numeric items. Make a ?deep? copy
-            df_result = df_zeroed.apply(lambda x: fill_others(x.values.tolist()), axis=1)
-            return df_result
-
-        # Define helper function
-        def hide_greater_than_date(cell, adate):
-            """ Helper function to compare date values in cells
-            """
-            result = False
-            try:
-                celldatetime = datetime.date(cell.year, cell.month, cell.day)
-            except:
-                return True
-            if celldatetime > adate:
-                return True
-            return False  # We have a date value in cell and it is less than or equal to input date
-
-        # Helper function
-        def appendDFToCSV(df, csvFilePath, sep="\t",date_format='%Y-%m-%d', encoding='utf-8'):
-            import os
-            if not os.path.isfile(csvFilePath):
-                df.to_csv(csvFilePath, mode='a', index=False, sep=sep, date_format=date_format, encoding=encoding)
-            elif len(df.columns) != len(pd.read_csv(csvFilePath, nrows=1, sep=sep).columns):
-                raise Exception(
-                    "Columns do not match!! Dataframe has " + str(len(df.columns)) + " columns. CSV file has " + str(
-                        len(pd.read_csv(csvFilePath, nrows=1, sep=sep).columns)) + " columns.")
-            elif not (df.columns == pd.read_csv(csvFilePath, nrows=1, sep=sep).columns).all():
-                raise Exception("Columns and column order of dataframe and csv file do not match!!")
-            else:
-                df.to_csv(csvFilePath, mode='a', index=False, sep=sep, header=False, date_format=date_format, encoding=encoding)
-
-
-        #print(pointscolumn)
+    def flow_tables(self, cycle_data):
+        """Return the number of issues in each state of the cycle on each
+        day, as a tuple of unstacked and stacked DataFrames (see
+        `flow.cumulative_flows()`), e.g. to slice by date for several charts.
+        """
+        cycle_names = [s['name'] for s in self.settings['cycle']]
+        return cumulative_flows(cycle_data[cycle_names])
+
+    def cfd_tables(self, cycle_data,size_history= None, pointscolumn= None):
+        """Return the unstacked and stacked data for a cumulative flow
+        diagram (see `cfd()`) as a tuple, working both out in a single pass.
+        """
 
         # List of all state change columns that may have date value in them
         cycle_names = [s['name'] for s in self.settings['cycle']]
 
         # Create list of columns that we want to return in our results dataFrame
-        slice_columns = list(self.settings['none_sized_statuses']) # Make a COPY of the list so that we dont modify the reference.
         if pointscolumn:
-            for size_state in self.settings['sized_statuses']:  # states_to_size:
-                sizedStateName = size_state + 'Sized'
-                slice_columns.append(sizedStateName)
-            # Check that it works if we use all columns as sized.
-            slice_columns = []
-            for size_state in cycle_names:
-                sizedStateName = size_state + 'Sized'
-                slice_columns.append(sizedStateName)
+            slice_columns = [size_state + 'Sized' for size_state in cycle_names]
         else:
             slice_columns = cycle_names
 
-
-        # Build a dataframe of just the "date" columns
-        df = cycle_data[cycle_names].copy()
-
-        # Strip out times from all dates
-        df = pd.DataFrame(
-            np.array(df.values, dtype='<M8[ns]').astype('<M8[D]').astype('<M8[ns]'),
-            columns=df.columns,
-            index=df.index
-        )
-
-        # No history provided this thus we return dataframe with just column headers.
+        # No history provided this thus we return dataframe with just the dates of each state, without times.
         if size_history is None:
-            return df
-
-        # Get a list of dates that a issue changed state
-        state_changes_on_dates_set = set()
-        for state in cycle_names:
-            state_changes_on_dates_set = state_changes_on_dates_set.union(set(df[state]))
-            # How many unique days did a issue stage state
-        # Remove non timestamp vlaues and sort the list
-        state_changes_on_dates = filter(lambda x: type(x.date()) == datetime.date,
-                                        sorted(list(state_changes_on_dates_set)))
-
-
-
-        # Replace missing NaT values (happens if a status is skipped) with the subsequent timestamp
-        df = df.fillna(method='bfill', axis=1)
-
-
-        if pointscolumn:
-            storypoints = cycle_data[pointscolumn] # As at today
-            ids = cycle_data['key']
-
-
-        # create blank results dataframe
-        df_results = pd.DataFrame()
-        # For each date on which we had a issue state change we want to count and sum the totals for each of the given states
-        # 'Open','Analysis','Backlog','In Process','Done','Withdrawn'
-        timenowstr = datetime.datetime.now().strftime('-run-%Y-%m-%d_%H-%M-%S')
-        for date_index,statechangedate in enumerate(state_changes_on_dates):
-            if date_index%10 == 0: # Print out Progress every tenth
-                pass #print("CFD state change {} of {} ".format(date_index,len(state_changes_on_dates)))
-            if type(statechangedate.date()) == datetime.date:
-                # filterdate.year,filterdate.month,filterdate.day
-                filterdate = datetime.date(statechangedate.year, statechangedate.month,
-                                           statechangedate.day)  # statechangedate.datetime()
-
-                # Apply function to each cell and only make it visible if issue was in state on or after the filter date
-                df_filtered = df.applymap(lambda x: 0 if hide_greater_than_date(x, filterdate) else 1)
-
-                if stacked:
-                    df_filtered=keeprightmoststate(df_filtered)
-
-                if pointscolumn and (size_history is not None):
-
-                    # For debug
-                    #if filterdate.isoformat() == '2016-11-22':
-                    #    size_history.loc[filterdate.isoformat()].to_csv("debug-size-history.csv")
-                    storypoints_series_on = size_history.loc[filterdate.isoformat()].T
-                    df_size_on_day = pd.Series.to_frame(storypoints_series_on)
-                    df_size_on_day.columns = [pointscolumn]
-
-                    # Make sure get size data in the same sequence as ids.
-                    left = pd.Series.to_frame(ids)
-                    right = df_size_on_day
-                    result = left.join(right, on=['key'])  # http://pandas.pydata.org/pandas-docs/stable/merging.html\
-                    df_countable = pd.concat([result, df_filtered], axis=1)
-                    # for debuging and analytics append the days state to file
-                    df_countable['date'] = filterdate.isoformat()
-                    if stacked:
-                        file_name = "daily-cfd-stacked-run-at"+ timenowstr + ".csv"
-                    else:
-                        file_name = "daily-cfd-run-at" + timenowstr + ".csv"
-                    appendDFToCSV(df_countable, file_name )
-                else:
-                    df_countable = df_filtered
-
-                # Because we size issues with Story Points we need to add some additional columns
-                # for each state based on size not just count
-                if pointscolumn:
-                    for size_state in self.settings['sized_statuses']: #states_to_size:
-                        sizedStateName = size_state + 'Sized'
-                        df_countable[sizedStateName] = df_countable.apply( lambda row: (row[pointscolumn] * row[size_state] ), axis=1)
-
-                # For debugging write dataframe to sheet for current day.
-                #file_name="countable-cfd-for-day-"+ filterdate.isoformat()+timenowstr+".csv"
-                #df_countable.to_csv(file_name, sep='\t', encoding='utf-8', quoting=csv.QUOTE_ALL)
-
-                df_slice = df_countable.loc[:,slice_columns].copy()
-                df_sub_sum = cumulativeColumnStates(df_slice,stacked)
-                final_table = df_sub_sum.rename(index={0: filterdate})
+            df = cycle_data[cycle_names].copy()
+            df = pd.DataFrame(floor_days(df.values), columns=df.columns, index=df.index)
+            return df, df
+
+        # Counting issues rather than summing sizes: sweep over the state entry events
+        if not pointscolumn:
+            return self.flow_tables(cycle_data)
+
+        # The day each issue entered each state; a skipped state takes the day of the next one
+        days = entry_days(cycle_data[cycle_names])
+        on_days = event_days(days)
+
+        # Only the sized statuses get a size; an issue counts in the furthest of those it has reached
+        sized_days = days.copy()
+        sized_days[:, np.array([name not in self.settings['sized_statuses'] for name in cycle_names], dtype=bool)] = NEVER
+
+        # Line up the size history with the issues once, then look up a vector of sizes per day
+        ids = cycle_data['key'].values
+        if isinstance(size_history, SizeHistory):
+            columns = size_history.columns_of(ids)
+            sizes_on = lambda row, day: size_history.sizes_at(day - size_history.first_day, columns)
+        else:
+            # Days missing from the frame take the sizes of the day before, or none before the first
+            aligned = size_history.reindex(columns=ids).sort_index()
+            dense_sizes = aligned.reindex(index=pd.DatetimeIndex(on_days.astype('datetime64[D]')), method='ffill').values.astype(float)
+            sizes_on = lambda row, day: dense_sizes[row]
 
-                # append to results
-                df_results = df_results.append(final_table)
-        df_results.sort_index(inplace=True)
+        # For debugging and analytics, optionally trace each day's states and sizes
+        trace = CfdTrace(self.settings['cfd_trace']) if self.settings.get('cfd_trace') else None
+        state_names = np.array(cycle_names + [None], dtype=object)
 
-        df= df_results
-        # Count number of times each date occurs, preserving column order
-        #df = pd.concat({col: df[col].value_counts() for col in df}, axis=1)[cycle_names]
+        # Total size in each state on each day on which a issue changed state, unstacked (False) and stacked (True)
+        tables = {False: np.zeros((len(on_days), len(cycle_names))), True: np.zeros((len(on_days), len(cycle_names)))}
+        try:
+            for row, day in enumerate(on_days):
+                sizes = sizes_on(row, day)
 
-        # Fill missing dates with 0 and run a cumulative sum
-        #df = df.fillna(0).cumsum(axis=0)
+                if trace is not None:
+                    trace.add(pd.Timestamp(np.datetime64(int(day), 'D')).date(), ids, state_names[rightmost_index(days <= day)], sizes)
 
-        # Reindex to make sure we have all dates
-        start, end = df.index.min(), df.index.max()
-        try: # If we have no change history we will not have any data in the df and will get a ValueError on reindex
-            df = df.reindex(pd.date_range(start, end, freq='D'), method='ffill')
-        except ValueError:
-            pass
+                for stacked in (False, True):
+                    tables[stacked][row] = flow_sizes(sized_days, day, sizes, stacked)
+        finally:
+            if trace is not None:
+                trace.close()
 
-        return df
+        # Days in between repeat the day before
+        return tuple(daily_frame(on_days, tables[stacked], slice_columns) for stacked in (False, True))
 
 
     def histogram(self, cycle_data, bins=10):
@@ -709,51 +525,106 @@ class CycleTimeQueries(QueryManager):
         return cycle_data['cycle_time'].dropna().quantile(percentiles)
 
     @staticmethod
-    def burnup_monte_carlo(start_value, target_value, start_date, throughput_data, trials=100):
+    def settle_trials(start_value, target_value, samples, trials, seed=None, processes=None,
+                      tolerance=None, percentiles=None, max_trials=DEFAULT_MAX_TRIALS):
+        """Decide how to run a burn-up simulation. Without a `tolerance`,
+        that is `trials` in chunks of `montecarlo.TRIALS_PER_CHUNK`. With one,
+        `trials` is the size of a batch: batches are run until the
+        `percentiles` of the number of steps move by no more than `tolerance`
+        steps, up to `max_trials` in all (see
+        `montecarlo.adaptive_simulate()`), and the number of trials used is
+        reported.
+
+        Returns a tuple of the seed, the steps each trial took if they were
+        simulated (else None), the number of trials and the chunk size, so
+        that `montecarlo.parallel_simulate()` and
+        `montecarlo.parallel_simulate_bands()` can run exactly those trials
+        again.
+        """
 
-        frequency = throughput_data.index.freq
+        seed = random_seed(seed)
+        if tolerance is None:
+            return seed, None, trials, TRIALS_PER_CHUNK
 
-        if 'count' in throughput_data.columns:
-            data_column_name = 'count'
-        else:
-            data_column_name = 'sum'
+        if percentiles is None:
+            percentiles = [0.5, 0.75, 0.85, 0.95]
 
-        # degenerate case - no steps, abort
-        if throughput_data[data_column_name].sum() <= 0:
-            return None
+        steps, settled = adaptive_simulate(start_value, target_value, samples, percentiles, tolerance,
+            batch_trials=trials, max_trials=max_trials, seed=seed, processes=processes)
+        if settled:
+            print("Info: Burn-up forecast settled after %d trials" % len(steps))
+        else:
+            print("Warning: Burn-up forecast did not settle within %d trials" % len(steps))
+        return seed, steps, len(steps), trials
 
-        # guess how far away we are; drawing samples one at a time is slow
-        sample_buffer_size = int(2 * (target_value - start_value) / throughput_data[data_column_name].mean())
+    @staticmethod
+    def burnup_monte_carlo(start_value, target_value, start_date, throughput_data, trials=100, seed=None, processes=None,
+                           tolerance=None, percentiles=None, max_trials=DEFAULT_MAX_TRIALS):
+        """Simulate `trials` burn-ups from `start_value` to `target_value`,
+        each step drawing a value at random from the throughput data (see
+        `montecarlo.parallel_simulate()`). Returns a DataFrame with a column
+        per trial, indexed by date from `start_date` at the frequency of the
+        throughput data, or None if there was no throughput.
+
+        A given `seed` gives the same trials as `burnup_finish_dates()`,
+        including with a `tolerance` (see `settle_trials()`).
+        """
 
-        sample_buffer = dict(idx=0, buffer=None)
+        frequency = throughput_data.index.freq
+        samples = throughput_values(throughput_data)
 
-        def get_sample():
-            if sample_buffer['buffer'] is None or sample_buffer['idx'] >= len(sample_buffer['buffer'].index):
-                sample_buffer['buffer'] = throughput_data[data_column_name].sample(sample_buffer_size, replace=True)
-                sample_buffer['idx'] = 0
+        # degenerate case - no steps, abort
+        if samples.sum() <= 0:
+            return None
 
-            sample_buffer['idx'] += 1
-            return sample_buffer['buffer'].iloc[sample_buffer['idx'] - 1]
+        seed, _, trials, chunk_size = CycleTimeQueries.settle_trials(start_value, target_value, samples, trials, seed, processes,
+            tolerance, percentiles, max_trials)
+        steps, paths = parallel_simulate(start_value, target_value, samples, trials, seed=seed, processes=processes,
+            chunk_size=chunk_size, keep_paths=True)
+        return trials_frame(paths, start_date, frequency)
 
-        series = {}
-        for t in range(trials):
-            current_date = start_date
-            current_value = start_value
+    @staticmethod
+    def burnup_finish_dates(start_value, target_value, start_date, throughput_data, trials=100, band_percentiles=None, seed=None, processes=None,
+                            tolerance=None, percentiles=None, max_trials=DEFAULT_MAX_TRIALS):
+        """Simulate burn-ups as for `burnup_monte_carlo()`, but keep only the
+        date on which each trial finished, never the full path of every
+        trial. Returns a tuple of a Series of finish dates and, if
+        `band_percentiles` are given, a DataFrame indexed by date with those
+        percentiles of the burn-up across trials (else None), or None if
+        there was no throughput.
+
+        Give a `seed` for repeatable results: the same seed gives the same
+        trials, with or without bands, as `burnup_monte_carlo()`. The trials
+        may be split across a pool of `processes` (see
+        `montecarlo.parallel_simulate()`).
+
+        If a `tolerance` is given, `trials` is instead the size of a batch:
+        batches are run until the `percentiles` of the finish dates move by
+        no more than `tolerance` periods of the throughput data, up to
+        `max_trials` in all (see `settle_trials()`). The number of trials
+        used is reported, and is the length of the finish dates. Bands are
+        then taken over those same trials.
+        """
 
-            dates = [current_date]
-            steps = [current_value]
+        frequency = throughput_data.index.freq
+        samples = throughput_values(throughput_data)
 
-            while current_value < target_value:
-                current_date += frequency
-                sample_data = get_sample()
-                current_value += sample_data
+        # degenerate case - no steps, abort
+        if samples.sum() <= 0:
+            return None
 
-                dates.append(current_date)
-                steps.append(current_value)
+        seed, steps, trials, chunk_size = CycleTimeQueries.settle_trials(start_value, target_value, samples, trials, seed, processes,
+            tolerance, percentiles, max_trials)
 
-            series["Trial %d" % t] = pd.Series(steps, index=dates, name="Trial %d" % t)
+        if band_percentiles is None:
+            if steps is None:
+                steps = parallel_simulate(start_value, target_value, samples, trials, seed=seed, processes=processes,
+                    chunk_size=chunk_size)
+            return finish_dates(steps, start_date, frequency), None
 
-        return pd.DataFrame(series)
+        steps, bands = parallel_simulate_bands(start_value, target_value, samples, trials, band_percentiles, seed=seed,
+            processes=processes, chunk_size=chunk_size)
+        return finish_dates(steps, start_date, frequency), bands_frame(bands, band_percentiles, start_date, frequency)
 
     def burnup_forecast(self,
         cfd_data,
@@ -763,7 +634,11 @@ class CycleTimeQueries(QueryManager):
         backlog_column=None,
         done_column=None,
         percentiles=[0.5, 0.75, 0.85, 0.95],
-        sized = ''
+        sized = '',
+        seed=None,
+        processes=None,
+        tolerance=None,
+        max_trials=DEFAULT_MAX_TRIALS
     ):
         try:
             if len(cfd_data.index) == 0:
@@ -793,24 +668,134 @@ class CycleTimeQueries(QueryManager):
         if target is None:
             target = cfd_data[backlog_column].max()
 
-        mc_trials = CycleTimeQueries.burnup_monte_carlo(
+        simulation = CycleTimeQueries.burnup_finish_dates(
             start_value=cfd_data[done_column].max(),
             target_value=target,
             start_date=cfd_data.index.max(),
             throughput_data=throughput_data,
-            trials=trials
+            trials=trials,
+            seed=seed,
+            processes=processes,
+            tolerance=tolerance,
+            percentiles=percentiles,
+            max_trials=max_trials
         )
 
-        if mc_trials is not None:
-
-            for col in mc_trials:
-                mc_trials[col][mc_trials[col] > target] = target
+        if simulation is not None:
+            finish_dates, bands = simulation
 
             # percentiles at finish line
-            finish_dates = mc_trials.apply(pd.Series.last_valid_index)
             finish_date_percentiles = finish_dates.quantile(percentiles).dt.normalize()
             #Convert burnup_forecast series into a dataframe with column headings so that can be saved to file with column headers
             result = pd.DataFrame({'Percentile': finish_date_percentiles.index, 'Date': finish_date_percentiles.values})
         else:
             result = pd.DataFrame(columns=['Date','Percentile'])
         return result
+
+    def segment_table(self, cycle_data, segment_column, frequency='1D', pointscolumn=None, start=None, end=None):
+        """Return a table of the work remaining in, and throughput of, each
+        segment of `cycle_data` by `segment_column` (e.g. an epic, or the
+        `query_attribute`), to forecast with `batch_forecast()`. It has
+        columns:
+
+        * `segment`: the value of `segment_column`
+        * `remaining`: the number of items not yet completed (or the sum of
+          `pointscolumn` over them)
+        * `throughput`: an array of the number of items (or sum of
+          `pointscolumn`) completed in each period of `frequency`, from the
+          period of the segment's first completion (or of `start`, if given)
+          to that of `end`
+
+        `end` should be the `start_date` of the forecast, so that periods
+        without completions up to then count; it defaults to the period of
+        the last completion in `cycle_data`. Completions outside the window
+        are not sampled.
+        """
+        work = cycle_data[pointscolumn].fillna(0) if pointscolumn else pd.Series(1, index=cycle_data.index)
+        completed = cycle_data['completed_timestamp'].notnull()
+
+        remaining = work[~completed].groupby(cycle_data[segment_column][~completed]).sum()
+
+        done = pd.DataFrame({
+            'segment': cycle_data[segment_column][completed],
+            'completed_timestamp': cycle_data['completed_timestamp'][completed],
+            'work': work[completed],
+        })
+        grouped = done.groupby(['segment', pd.Grouper(key='completed_timestamp', freq=frequency)])['work']
+        periods = grouped.sum().unstack(fill_value=0)
+        first = (grouped.size().unstack(fill_value=0) > 0).idxmax(axis=1) if len(periods.columns) > 0 else pd.Series()
+
+        # The period in which a timestamp falls, labelled as by `pd.Grouper`
+        period_of = lambda timestamp: pd.Series([0], index=pd.DatetimeIndex([pd.Timestamp(timestamp)])).resample(frequency).sum().index[0]
+
+        if len(periods.columns) > 0 or (start is not None and end is not None):
+            window_start = period_of(start) if start is not None else periods.columns.min()
+            window_end = period_of(end) if end is not None else periods.columns.max()
+            periods = periods.reindex(columns=pd.date_range(window_start, window_end, freq=frequency), fill_value=0)
+
+        def throughput(segment):
+            if segment not in periods.index:
+                return np.zeros(len(periods.columns))
+            row = periods.loc[segment]
+            if start is None:
+                row = row[row.index >= first[segment]]
+            return row.values.astype(float)
+
+        segments = sorted(set(remaining.index) | set(periods.index))
+        return pd.DataFrame({
+            'segment': segments,
+            'remaining': [remaining.get(segment, 0) for segment in segments],
+            'throughput': [throughput(segment) for segment in segments],
+        }, columns=['segment', 'remaining', 'throughput'])
+
+    def batch_forecast(self,
+        segments,
+        start_date,
+        frequency='1D',
+        trials=1000,
+        percentiles=[0.5, 0.75, 0.85, 0.95],
+        date=None,
+        seed=None
+    ):
+        """Forecast many segments at once (see `montecarlo.segment_simulation()`),
+        given a table like that of `segment_table()`, simulating each period of
+        `frequency` after `start_date` from the segment's `throughput`.
+
+        Returns a DataFrame with a row for each segment and percentile, with
+        columns `Segment`, `Percentile` and `Date`, the date by which the
+        remaining work is done with that confidence (NaT if the segment has
+        no throughput). If a `date` is given, the column `Items` holds the
+        work that will be done by then with that confidence.
+        """
+        columns = ['Segment', 'Percentile', 'Date'] + (['Items'] if date is not None else [])
+        if len(segments) == 0:
+            return pd.DataFrame(columns=columns)
+
+        frequency = pd.tseries.frequencies.to_offset(frequency)
+        start_date = pd.Timestamp(start_date)
+        by_step = steps_until(start_date, frequency, pd.Timestamp(date)) if date is not None else None
+
+        steps, done_by = segment_simulation(
+            segments['remaining'].values,
+            list(segments['throughput']),
+            trials,
+            by_step=by_step,
+            random_state=seed
+        )
+
+        # Percentiles of the finish dates, interpolated as `Series.quantile()` would
+        dates = np.asarray(step_dates(start_date, frequency, max(steps.max(), 0) + 1), dtype='datetime64[ns]').astype(np.int64)
+        finish = np.where(steps >= 0, dates[np.maximum(steps, 0)], np.nan)
+        finish_percentiles = np.percentile(finish, [100.0 * p for p in percentiles], axis=1).T
+
+        result = pd.DataFrame({
+            'Segment': np.repeat(segments['segment'].values, len(percentiles)),
+            'Percentile': np.tile(percentiles, len(segments)),
+            'Date': pd.to_datetime(np.where(np.isnan(finish_percentiles), np.nan, finish_percentiles).ravel()).normalize(),
+        }, columns=columns)
+
+        # The work done by `date` in at least the given share of trials
+        if date is not None:
+            result['Items'] = np.percentile(done_by, [100.0 * (1 - p) for p in percentiles], axis=1).T.ravel()
+
+        return result
@@ -0,0 +1,120 @@
+from past.builtins import basestring
+import re
+
+from .timestamps import parse_timestamp
+
+# Keys used by `jira` resources, in order, when rendering themselves as strings
+READABLE_IDS = ('displayName', 'key', 'name', 'filename', 'value', 'scope', 'votes', 'id', 'mimeType', 'closed')
+
+# Date/time values that are converted to (time zone naive) datetimes
+DATE_VALUE = re.compile(r'^\d{4}[- ]?\d\d[- ]?\d\d[T ]\d\d:\d\d:\d\d[.+]\d{2,6}[+-:]\d{2,6}$')
+
+
+def readable_value(value):
+    """Return the human readable part of a raw JSON object, as a `jira`
+    resource would when converted to a string.
+    """
+    for name in READABLE_IDS:
+        if name in value:
+            return value[name]
+    return value
+
+
+def field_index(fields):
+    """Return a dict mapping the lower case name of each field in a list of
+    JIRA field definitions to its id. The first field with a name wins.
+    """
+    index = {}
+    for field in fields:
+        index.setdefault(field['name'].lower(), field['id'])
+    return index
+
+
+def field_resolver(known_values=None):
+    """Return a function that turns the raw JSON value of a field into the
+    value to extract.
+
+    * Options (`{"value": ...}`) give their value, joined to the value of a
+      cascading `child` option with `|`.
+    * Lists give the `name` of each item joined with `|` or, if
+      `known_values` are given, the first known value found in the list.
+    * Other objects give their human readable part.
+    * Date/time strings are converted to datetimes without a time zone.
+
+    The choice of how to handle a value is made on its type.
+    """
+
+    known_rank = None
+    if known_values is not None:
+        known_rank = {}
+        for rank, known in enumerate(known_values):
+            known_rank.setdefault(known, rank)
+
+    def resolve_string(value):
+        if DATE_VALUE.match(value):
+            # Remove the timezone element as excel does not handle
+            return parse_timestamp(value).replace(tzinfo=None)
+        return value
+
+    def resolve_list(value):
+        if len(value) == 0:
+            return None
+
+        values = [v.get('name', readable_value(v)) if isinstance(v, dict) else v for v in value]
+        if known_rank is None:
+            return '|'.join([str(x) for x in values])
+
+        try:
+            ranks = [known_rank[v] for v in values if v in known_rank]
+        except TypeError:  # unhashable values are never known values
+            ranks = [known_rank[v] for v in values if isinstance(v, basestring) and v in known_rank]
+        return known_values[min(ranks)] if len(ranks) > 0 else None
+
+    def resolve_scalar(value):
+        if isinstance(value, dict):
+            value = readable_value(value)
+        if not isinstance(value, (int, float, bool, basestring)):
+            try:
+                value = str(value)
+            except TypeError:
+                return value
+        if isinstance(value, basestring):
+            return resolve_string(value)
+        return value
+
+    def resolve_value(value):
+        if isinstance(value, (list, tuple)):
+            return resolve_list(value)
+        return resolve_scalar(value)
+
+    def resolve_option(value):
+        if 'value' not in value:
+            return resolve_scalar(value)
+
+        option = value['value']
+        child = value.get('child')
+        if isinstance(child, dict) and child.get('value') and isinstance(option, basestring):
+            option = option + "|" + child['value']
+
+        return resolve_value(option)
+
+    def keep(value):
+        return value
+
+    handlers = {
+        dict: resolve_option,
+        list: resolve_list,
+        tuple: resolve_list,
+        str: resolve_string,
+        type(u''): resolve_string,
+        int: keep,
+        float: keep,
+        bool: keep,
+    }
+
+    def resolve(value):
+        if value is None:
+            return None
+        return handlers.get(type(value), resolve_value)(value)
+
+    return resolve
@@ -0,0 +1,151 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from .arrays import backfill_rows, rightmost_index
+
+# Entry day of a state that was never entered
+NEVER = np.iinfo(np.int64).max
+
+
+def entry_days(dates):
+    """Return the day (since the epoch) each issue entered each state, from
+    a DataFrame of state entry dates with a column per state in cycle order,
+    as an int64 matrix. A skipped state takes the day of the next state
+    entered, and states not reached are `NEVER`.
+    """
+    days = np.column_stack([
+        np.asarray(dates[column], dtype='datetime64[ns]').astype('datetime64[D]')
+        for column in dates.columns
+    ]) if len(dates.columns) > 0 else np.empty((len(dates), 0), dtype='datetime64[D]')
+
+    return backfill_rows(days.astype(np.int64), np.isnat(days), NEVER)
+
+
+def event_days(days):
+    """Return the distinct days on which any issue entered a state, sorted
+    """
+    days = days[days != NEVER]
+    return np.unique(days)
+
+
+def cumulative_counts(days, on_days):
+    """Return a matrix with, for each of `on_days` and each column of the
+    `days` matrix, the number of rows where the day is on or before it.
+    """
+    result = np.empty((len(on_days), days.shape[1]), dtype=np.int64)
+    for column in range(days.shape[1]):
+        result[:, column] = np.searchsorted(np.sort(days[:, column]), on_days, side='right')
+    return result
+
+
+def furthest_entry_days(days):
+    """Return, for each issue and state, the first day the issue was in that
+    state or any later one.
+    """
+    return np.minimum.accumulate(days[:, ::-1], axis=1)[:, ::-1]
+
+
+def flow_counts(days, on_days, stacked=True):
+    """Return the number of issues in each state on each of `on_days`, from
+    a matrix of `entry_days()`.
+
+    If not `stacked`, an issue counts in every state it has reached. If
+    `stacked`, it only counts in the furthest state it has reached, i.e. in
+    state `s` if it had reached `s` but no later state.
+    """
+    if not stacked:
+        return cumulative_counts(days, on_days)
+
+    reached = cumulative_counts(furthest_entry_days(days), on_days)
+    result = reached.copy()
+    result[:, :-1] -= reached[:, 1:]
+    return result
+
+
+def flow_sizes(days, on_day, sizes, stacked=True):
+    """Return the total size of the issues in each state on `on_day`, from
+    a matrix of `entry_days()` and the size of each issue on that day (NaN
+    sizes count as zero).
+
+    As for `flow_counts()`, an issue adds its size to every state it has
+    reached, or, if `stacked`, only to the furthest of them.
+    """
+    sizes = np.where(np.isnan(sizes), 0.0, sizes)
+    reached = days <= on_day
+
+    if not stacked:
+        return np.dot(sizes, reached)
+
+    furthest = rightmost_index(reached)
+    issues = furthest >= 0
+    return np.bincount(furthest[issues], weights=sizes[issues], minlength=days.shape[1]).astype(float)
+
+
+def daily_frame(on_days, table, columns):
+    """Return a DataFrame indexed by every day from the first to the last of
+    (sorted) `on_days`, with the rows of `table` for those days and the
+    values of the day before for any other day.
+    """
+    if len(on_days) == 0:
+        return pd.DataFrame(columns=columns)
+
+    all_days = np.arange(on_days[0], on_days[-1] + 1)
+    rows = np.searchsorted(on_days, all_days, side='right') - 1
+
+    index = pd.date_range(np.datetime64(int(on_days[0]), 'D'), periods=len(all_days), freq='D')
+    return pd.DataFrame(table[rows], index=index, columns=columns)
+
+
+def cumulative_flows(dates):
+    """Return the data for unstacked and stacked cumulative flow diagrams
+    from a DataFrame of state entry dates (a column per state, in cycle
+    order): a tuple of DataFrames indexed by day with the number of issues
+    in each state (see `flow_counts()`).
+
+    Each issue's entry into a state is an event. Events are sorted once per
+    state, and the counts on each day on which any event happened are found
+    by binary search; days in between repeat the day before.
+    """
+    days = entry_days(dates)
+    on_days = event_days(days)
+    columns = list(dates.columns)
+    return tuple(daily_frame(on_days, flow_counts(days, on_days, stacked), columns) for stacked in (False, True))
+
+
+def cumulative_flow(dates, stacked=True):
+    """Return the unstacked or stacked table of `cumulative_flows()`
+    """
+    return cumulative_flows(dates)[1 if stacked else 0]
+
+
+class CfdTrace(object):
+    """An opt-in record of the data behind a sized CFD, written to a tab
+    separated file as it is worked out: for each day on which a state
+    changed, a line for each issue that had entered a state, giving the
+    date, the issue key, the furthest state it had reached, and its size
+    on that day.
+    """
+
+    columns = ('date', 'key', 'state', 'size')
+
+    def __init__(self, path, sep='\t'):
+        self.path = path
+        self.sep = sep
+        self.file = io.open(path, 'w', encoding='utf-8')
+        self.file.write(u'%s\n' % sep.join(self.columns))
+
+    def add(self, date, keys, states, sizes):
+        """Record a day: the `keys`, furthest `states` (or None) and `sizes`
+        of the issues.
+        """
+        day = date.isoformat()
+        self.file.write(u''.join([
+            u'%s%s%s%s%s%s%s\n' % (day, self.sep, key, self.sep, state, self.sep, u'' if size != size else size)
+            for key, state, size in zip(keys, states, sizes)
+            if state is not None
+        ]))
+
+    def close(self):
+        self.file.close()
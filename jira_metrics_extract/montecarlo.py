@@ -0,0 +1,443 @@
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+# Trials simulated by each worker. Each chunk of trials has its own random
+# stream, so seeded results depend on this but not on the number of processes.
+TRIALS_PER_CHUNK = 5000
+
+# Trials per batch, and the most trials to run, when running trials until
+# the forecast settles
+DEFAULT_BATCH_TRIALS = 1000
+DEFAULT_MAX_TRIALS = 100000
+
+# Number of batches in a row over which the forecast must stay within the
+# tolerance to have settled
+SETTLE_BATCHES = 3
+
+
+def as_random_state(seed=None):
+    """Return a `numpy.random.RandomState` for `seed`, which may be None (to
+    seed from the operating system), an integer or an existing state.
+    """
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    return np.random.RandomState(seed)
+
+
+def throughput_values(throughput_data):
+    """Return the `count` (or, for sized throughput, `sum`) column of a
+    throughput DataFrame as an array of floats to sample from.
+    """
+    column = 'count' if 'count' in throughput_data.columns else 'sum'
+    return np.asarray(throughput_data[column], dtype=float)
+
+
+def block_steps(start_value, target_value, samples):
+    """Guess how many steps a trial needs: twice the number at the mean
+    throughput, so that most trials finish within one block of samples.
+    """
+    return max(int(2 * (target_value - start_value) / samples.mean()), 1)
+
+
+def trial_blocks(start_value, target_value, samples, trials, random_state=None, steps_per_block=None):
+    """Simulate `trials` runs from `start_value` up to `target_value`, adding
+    a value drawn at random (with replacement) from `samples` at each step.
+
+    All unfinished trials draw a block of steps at a time, as a matrix, and
+    take cumulative sums of it. Generates `(rows, offset, values)` for each
+    block: the trials still running, the number of steps before the block,
+    and the value of each of those trials after each step in the block.
+    """
+    samples = np.asarray(samples, dtype=float)
+    random_state = as_random_state(random_state)
+
+    if target_value <= start_value or trials <= 0:
+        return
+
+    if steps_per_block is None:
+        steps_per_block = block_steps(start_value, target_value, samples)
+
+    current = np.full(trials, float(start_value))
+    active = np.arange(trials)
+    offset = 0
+
+    while len(active) > 0:
+        draws = np.empty((len(active), steps_per_block + 1))
+        draws[:, 0] = current[active]
+        draws[:, 1:] = samples[random_state.randint(0, len(samples), size=(len(active), steps_per_block))]
+        values = np.cumsum(draws, axis=1)[:, 1:]
+
+        yield active, offset, values
+
+        current[active] = values[:, -1]
+        active = active[~(values >= target_value).any(axis=1)]
+        offset += steps_per_block
+
+
+def block_finish_steps(offset, values, target_value):
+    """Return the step at which each trial in a block reaches the target, or
+    0 if it does not within the block.
+    """
+    reached = values >= target_value
+    return np.where(reached.any(axis=1), offset + np.argmax(reached, axis=1) + 1, 0)
+
+
+def simulate(start_value, target_value, samples, trials, random_state=None, steps_per_block=None, keep_paths=False):
+    """Simulate trials as for `trial_blocks()`. Returns an array with the
+    number of steps each trial took to reach the target or, if `keep_paths`,
+    a tuple of that and a (trials x steps + 1) matrix of the value of each
+    trial after each step, NaN once finished.
+
+    Without `keep_paths`, only one block of samples is held at a time.
+    """
+    steps = np.zeros(trials, dtype=np.int64)
+    blocks = []
+
+    for rows, offset, values in trial_blocks(start_value, target_value, samples, trials, random_state, steps_per_block):
+        steps[rows] += block_finish_steps(offset, values, target_value)
+        if keep_paths:
+            blocks.append((rows, offset, values))
+
+    if not keep_paths:
+        return steps
+
+    paths = np.full((trials, steps.max() + 1 if trials > 0 else 1), np.nan)
+    paths[:, 0] = start_value
+    for rows, offset, values in blocks:
+        width = min(values.shape[1], paths.shape[1] - 1 - offset)
+        paths[rows, offset + 1:offset + 1 + width] = values[:, :width]
+    paths[np.arange(paths.shape[1]) > steps[:, np.newaxis]] = np.nan
+
+    return steps, paths
+
+
+def simulate_bands(start_value, target_value, samples, trials, percentiles, random_state=None, steps_per_block=None):
+    """Simulate trials as for `simulate()`, but rather than the path of each
+    trial keep only percentile bands across trials: a (percentiles x steps
+    + 1) matrix with the given percentiles (between 0 and 1) of the value of
+    all trials after each step, taking finished trials to stay at the
+    target. Returns a tuple of the steps each trial took and the bands.
+    """
+    percentiles = [100.0 * p for p in percentiles]
+
+    steps = np.zeros(trials, dtype=np.int64)
+    bands = [np.full((len(percentiles), 1), float(start_value))]
+
+    for rows, offset, values in trial_blocks(start_value, target_value, samples, trials, random_state, steps_per_block):
+        steps[rows] += block_finish_steps(offset, values, target_value)
+
+        block = np.full((trials, values.shape[1]), float(target_value))
+        block[rows] = np.minimum(values, target_value)
+        bands.append(np.percentile(block, percentiles, axis=0).reshape(len(percentiles), -1))
+
+    bands = np.concatenate(bands, axis=1)[:, :steps.max() + 1 if trials > 0 else 1]
+    return steps, bands
+
+
+def chunk_trials(trials, chunk_size=TRIALS_PER_CHUNK):
+    """Return the number of trials in each chunk of `trials`
+    """
+    return [min(chunk_size, trials - start) for start in range(0, trials, chunk_size)]
+
+
+def simulate_chunk(chunk):
+    """Simulate a chunk of trials, given as a tuple of `start_value`,
+    `target_value`, `samples`, the number of trials, the seed of its random
+    stream and whether to keep paths. Returns what `simulate()` does.
+    """
+    start_value, target_value, samples, trials, seed, keep_paths = chunk
+    return simulate(start_value, target_value, samples, trials, random_state=np.random.RandomState(seed), keep_paths=keep_paths)
+
+
+def value_counts(values):
+    """Return the distinct values of a 1D array and the number of times each
+    occurs, as a tuple of arrays
+    """
+    values = np.sort(values)
+    first = np.flatnonzero(np.append(True, values[1:] != values[:-1]))
+    return values[first], np.diff(np.append(first, len(values)))
+
+
+def simulate_chunk_counts(chunk):
+    """Simulate a chunk of trials given as for `simulate_chunk()`, but
+    rather than the path of each trial return, for each step after the
+    first, the `value_counts()` of the value of all trials in the chunk,
+    taking finished trials to stay at the target. Returns a tuple of the
+    steps each trial took and a list of those counts.
+    """
+    start_value, target_value, samples, trials, seed, keep_paths = chunk
+
+    steps = np.zeros(trials, dtype=np.int64)
+    counts = []
+
+    for rows, offset, values in trial_blocks(start_value, target_value, samples, trials, np.random.RandomState(seed)):
+        steps[rows] += block_finish_steps(offset, values, target_value)
+
+        block = np.full((trials, values.shape[1]), float(target_value))
+        block[rows] = np.minimum(values, target_value)
+        counts.extend(value_counts(block[:, i]) for i in range(block.shape[1]))
+
+    return steps, counts[:steps.max() if trials > 0 else 0]
+
+
+def counted_percentiles(values, counts, percentiles):
+    """Return the given percentiles (between 0 and 1) of values that occur
+    `counts` times each, interpolated as `numpy.percentile()` does
+    """
+    order = np.argsort(values, kind='mergesort')
+    values = values[order]
+    ranks = np.cumsum(counts[order])
+
+    positions = np.asarray(percentiles, dtype=float) * (ranks[-1] - 1)
+    lower = np.floor(positions)
+    below = values[np.searchsorted(ranks, lower, side='right')]
+    above = values[np.searchsorted(ranks, np.minimum(lower + 1, ranks[-1] - 1), side='right')]
+    return below + (above - below) * (positions - lower)
+
+
+def chunk_pool(processes):
+    """Return a pool of `processes` worker processes (0 for one per CPU), or
+    None to run chunks in this process if `processes` is None or 1.
+    """
+    if processes is None or processes == 1:
+        return None
+    return multiprocessing.Pool(processes or None)
+
+
+def map_chunks(pool, chunks, function=simulate_chunk):
+    """Simulate chunks of trials with `function` (`simulate_chunk()` or
+    `simulate_chunk_counts()`) on `pool`, or in this process if it is None.
+    Returns the result of each chunk, in order.
+    """
+    if pool is None or len(chunks) <= 1:
+        return [function(chunk) for chunk in chunks]
+    return pool.map(function, chunks)
+
+
+def random_seed(seed=None):
+    """Return `seed`, or a seed picked at random if it is None
+    """
+    if seed is None:
+        return np.random.RandomState().randint(0, 2 ** 31 - 1)
+    return seed
+
+
+def run_chunks(start_value, target_value, samples, trials, seed, processes, chunk_size, keep_paths=False, function=simulate_chunk):
+    """Split `trials` into chunks of `chunk_size`, chunk `i` drawing from a
+    stream seeded with `[seed, i]`, and return the result of each chunk in
+    order, run on a pool of `processes` (see `chunk_pool()`).
+    """
+    samples = np.asarray(samples, dtype=float)
+    chunks = [(start_value, target_value, samples, n, [seed, i], keep_paths) for i, n in enumerate(chunk_trials(trials, chunk_size))]
+
+    pool = chunk_pool(processes)
+    try:
+        return map_chunks(pool, chunks, function)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def parallel_simulate(start_value, target_value, samples, trials, seed=None, processes=None,
+                      chunk_size=TRIALS_PER_CHUNK, keep_paths=False):
+    """Simulate trials as for `simulate()`, split into chunks of
+    `chunk_size` that may be run on a pool of `processes` worker processes
+    (0 for one per CPU; None or 1 to run them in this process).
+
+    Chunk `i` draws from its own stream, seeded with `[seed, i]`, and the
+    results of each chunk are put back in chunk order, so that a given
+    `seed` always gives the same trials however many processes are used,
+    and whether or not paths are kept. Without a `seed`, one is picked at
+    random.
+    """
+    results = run_chunks(start_value, target_value, samples, trials, random_seed(seed), processes, chunk_size, keep_paths)
+
+    if not keep_paths:
+        if len(results) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(results)
+
+    if len(results) == 0:
+        return np.zeros(0, dtype=np.int64), np.full((0, 1), float(start_value))
+
+    width = max(paths.shape[1] for steps, paths in results)
+    paths = np.full((trials, width), np.nan)
+    row = 0
+    for chunk_steps, chunk_paths in results:
+        paths[row:row + len(chunk_steps), :chunk_paths.shape[1]] = chunk_paths
+        row += len(chunk_steps)
+
+    return np.concatenate([steps for steps, paths in results]), paths
+
+
+def parallel_simulate_bands(start_value, target_value, samples, trials, percentiles, seed=None, processes=None,
+                            chunk_size=TRIALS_PER_CHUNK):
+    """Simulate the same trials as `parallel_simulate()`, but rather than
+    the path of each trial keep only percentile bands across trials, as for
+    `simulate_bands()`. Each chunk counts the values of its trials after
+    each step (see `simulate_chunk_counts()`), and the counts of all chunks
+    are merged to find the percentiles. Returns a tuple of the steps each
+    trial took and the bands.
+    """
+    results = run_chunks(start_value, target_value, samples, trials, random_seed(seed), processes, chunk_size,
+                         function=simulate_chunk_counts)
+
+    steps = np.concatenate([chunk_steps for chunk_steps, counts in results]) if len(results) > 0 else np.zeros(0, dtype=np.int64)
+    bands = np.full((len(percentiles), (steps.max() if len(steps) > 0 else 0) + 1), float(start_value))
+
+    for step in range(1, bands.shape[1]):
+        values = []
+        counts = []
+        for chunk_steps, chunk_counts in results:
+            # Every trial of a chunk that finished earlier is at the target
+            chunk_values, chunk_value_counts = chunk_counts[step - 1] if step <= len(chunk_counts) else \
+                (np.array([float(target_value)]), np.array([len(chunk_steps)]))
+            values.append(chunk_values)
+            counts.append(chunk_value_counts)
+        bands[:, step] = counted_percentiles(np.concatenate(values), np.concatenate(counts), percentiles)
+
+    return steps, bands
+
+
+def adaptive_simulate(start_value, target_value, samples, percentiles, tolerance,
+                      batch_trials=DEFAULT_BATCH_TRIALS, max_trials=DEFAULT_MAX_TRIALS, seed=None, processes=None):
+    """Simulate trials as for `parallel_simulate()`, in batches of
+    `batch_trials`, until the given percentiles (between 0 and 1) of the
+    number of steps taken have moved by no more than `tolerance` steps over
+    the last `SETTLE_BATCHES` batches, or `max_trials` have been run.
+
+    Batch `i` draws from a stream seeded with `[seed, i]`. With `processes`,
+    several batches are run at once, but whether to stop is still decided
+    after each batch in turn, so a given `seed` always gives the same
+    result. Returns a tuple of the steps each trial took and whether the
+    percentiles settled.
+    """
+    seed = random_seed(seed)
+    samples = np.asarray(samples, dtype=float)
+    percentiles = [100.0 * p for p in percentiles]
+
+    results = []
+    history = []
+    total = 0
+
+    pool = chunk_pool(processes)
+    try:
+        batches_at_once = 1 if pool is None else (processes or multiprocessing.cpu_count())
+        while total < max_trials:
+            sizes = chunk_trials(min(batches_at_once * batch_trials, max_trials - total), batch_trials)
+            chunks = [(start_value, target_value, samples, n, [seed, len(results) + i], False) for i, n in enumerate(sizes)]
+
+            for steps in map_chunks(pool, chunks):
+                results.append(steps)
+                total += len(steps)
+
+                history.append(np.percentile(np.concatenate(results), percentiles))
+                recent = np.array(history[-SETTLE_BATCHES - 1:])
+                if len(recent) > SETTLE_BATCHES and (recent.max(axis=0) - recent.min(axis=0)).max() <= tolerance:
+                    return np.concatenate(results), True
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if len(results) == 0:
+        return np.zeros(0, dtype=np.int64), False
+    return np.concatenate(results), False
+
+
+def segment_simulation(remaining, samples, trials, by_step=None, random_state=None):
+    """Simulate `trials` runs for each of a number of segments (e.g. epics)
+    at once: segment `i` has `remaining[i]` work left and draws each step's
+    progress from its own `samples[i]`.
+
+    At each step, one uniform random number per trial is shared by all
+    segments and picks a value from the samples of each, so that every
+    segment is simulated from the same matrix of random numbers in one pass
+    over the steps.
+
+    Returns a tuple of a (segments x trials) matrix of the step at which
+    each trial finished (-1 for segments with no progress in their samples)
+    and, if `by_step` is given, a matrix of the work done after that many
+    steps, at most the work remaining (else None).
+    """
+    remaining = np.asarray(remaining, dtype=float)
+    random_state = as_random_state(random_state)
+
+    lengths = np.array([len(s) for s in samples], dtype=np.int64)
+    padded = np.zeros((len(remaining), max(lengths.max() if len(lengths) > 0 else 0, 1)))
+    for i, values in enumerate(samples):
+        padded[i, :len(values)] = values
+
+    # Segments whose samples are all zero never finish
+    possible = (remaining <= 0) | (padded.sum(axis=1) > 0)
+
+    steps = np.where(remaining <= 0, 0, -1)[:, np.newaxis].repeat(trials, axis=1)
+    done = np.zeros((len(remaining), trials))
+    done_by = done.copy() if by_step == 0 else None
+
+    step = 0
+    while True:
+        running = (steps < 0) & possible[:, np.newaxis]
+        rows = np.flatnonzero(running.any(axis=1) | (by_step is not None and step < by_step))
+        if len(rows) == 0:
+            break
+
+        step += 1
+        uniform = random_state.random_sample(trials)
+        done[rows] += padded[rows[:, np.newaxis], (uniform * lengths[rows, np.newaxis]).astype(np.int64)]
+
+        steps[running & (done >= remaining[:, np.newaxis])] = step
+        if step == by_step:
+            done_by = np.minimum(done, remaining[:, np.newaxis])
+
+    return steps, done_by
+
+
+def steps_until(start_date, frequency, date):
+    """Return the number of steps of `frequency` from `start_date` up to and
+    including `date`
+    """
+    steps = 0
+    current = start_date + frequency
+    while current <= date:
+        steps += 1
+        current += frequency
+    return steps
+
+
+def step_dates(start_date, frequency, count):
+    """Return the dates of `count` steps of `frequency`, from `start_date`
+    """
+    dates = [start_date]
+    for i in range(1, count):
+        dates.append(dates[-1] + frequency)
+    return pd.DatetimeIndex(dates)
+
+
+def trials_frame(paths, start_date, frequency):
+    """Return a matrix of trial paths from `simulate()` as a DataFrame with a
+    column per trial (`Trial 0`, `Trial 1`, ...) indexed by date.
+    """
+    return pd.DataFrame(
+        paths.T,
+        index=step_dates(start_date, frequency, paths.shape[1]),
+        columns=["Trial %d" % t for t in range(paths.shape[0])]
+    )
+
+
+def finish_dates(steps, start_date, frequency):
+    """Return the date on which each trial finished, from the steps returned
+    by `simulate()`, as a Series.
+    """
+    dates = step_dates(start_date, frequency, steps.max() + 1 if len(steps) > 0 else 1)
+    return pd.Series(dates[steps], index=["Trial %d" % t for t in range(len(steps))])
+
+
+def bands_frame(bands, percentiles, start_date, frequency):
+    """Return the bands from `simulate_bands()` as a DataFrame with a column
+    per percentile, indexed by date.
+    """
+    return pd.DataFrame(bands.T, index=step_dates(start_date, frequency, bands.shape[1]), columns=list(percentiles))
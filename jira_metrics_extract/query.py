@@ -1,10 +1,22 @@
 from past.builtins import basestring
 import itertools
 import datetime
-import dateutil.parser
 import dateutil.tz
-import re
+import json
+from multiprocessing.pool import ThreadPool
 from jira import JIRA, JIRAError
+from jira.resources import Issue
+
+from .cache import IssueCache, cache_directory, cached_fields, DEFAULT_FIELDS_TTL
+from .fields import field_index, field_resolver
+from .changelog import decode_changelog, STATUS, RESOLUTION, SIZE
+
+# Use a fast JSON decoder for raw searches if one is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 
 def to_datetime(date):
     """Turn a date into a datetime at midnight.
@@ -17,6 +29,12 @@ def strip_time(datetime):
     """
     return to_datetime(datetime.date())
 
+def raw_issue(issue):
+    """Return the raw JSON dict of an issue, which may be a `jira` Issue
+    resource or already a dict from a raw search.
+    """
+    return getattr(issue, 'raw', issue)
+
 class IssueSnapshot(object):
     """A snapshot of the key fields of an issue at a point in its change history
     """
@@ -56,6 +74,17 @@ class IssueSizeSnapshot(object):
         )
 
 
+class IncompleteResults(Exception):
+    """JIRA returned fewer issues than it reported matching a query
+    """
+
+
+class RawPage(list):
+    """A page of raw issue dicts, with the `total` number of matching issues
+    """
+    total = None
+
+
 class QueryManager(object):
     """Manage and execute queries
     """
@@ -66,9 +95,17 @@ class QueryManager(object):
         fields={},
         known_values={},
         max_results=500,
+        cache_jira=None,
+        fetch_concurrency=1,
+        raw_json=False,
+        fields_cache_ttl=DEFAULT_FIELDS_TTL,
     )
 
     fields = {}  # resolved at runtime to JIRA fields
+    field_resolvers = {}  # compiled at runtime for each of `fields`
+
+    # Fields always read from each issue; see `search_fields()`
+    search_fields_fixed = ['summary', 'status', 'issuetype', 'resolution', 'created', 'issuelinks']
 
     def __init__(self, jira, **kwargs):
         self.jira = jira
@@ -81,165 +118,139 @@ class QueryManager(object):
     # Helpers
 
     def resolve_fields(self):
-        fields = self.jira.fields()
+        """Find the JIRA field id for each of the `fields` in settings, and
+        compile a resolver for its values (see `field_resolver()`).
 
+        If the `cache_jira` setting is set, the list of JIRA fields is kept
+        there for `fields_cache_ttl` seconds. It is fetched again if it has
+        no field by one of the names, e.g. one created since it was cached.
+        """
+        directory = cache_directory(self.settings['cache_jira'])
+        cached = directory is not None and self.settings['fields_cache_ttl']
+        if cached:
+            fields = cached_fields(directory, self.jira._options['server'], self.jira.fields, self.settings['fields_cache_ttl'])
+        else:
+            fields = self.jira.fields()
+
+        index = field_index(fields)
+        if cached and any(field.lower() not in index for field in self.settings['fields'].values()):
+            fields = cached_fields(directory, self.jira._options['server'], self.jira.fields, self.settings['fields_cache_ttl'], refresh=True)
+            index = field_index(fields)
+
+        self.fields = {}
+        self.field_resolvers = {}
         for name, field in self.settings['fields'].items():
             try:
-                self.fields[name] = next((f['id'] for f in fields if f['name'].lower() == field.lower()))
-            except StopIteration:
+                self.fields[name] = index[field.lower()]
+            except KeyError:
                 raise Exception("JIRA field with name `%s` does not exist (did you try to use the field id instead?)" % field)
+            self.field_resolvers[name] = field_resolver(self.settings['known_values'].get(name))
+
+    def search_fields(self):
+        """Return the ids of the fields to request when searching: those
+        read when extracting cycle data plus the configured `fields`.
+        """
+        fields = list(self.search_fields_fixed)
+        if cache_directory(self.settings['cache_jira']) is not None:
+            fields.append('updated')
+        for field_id in self.fields.values():
+            if field_id not in fields:
+                fields.append(field_id)
+        return fields
 
     def resolve_field_value(self, issue, name, field_name):
         try:
-            field_value = getattr(issue.fields, field_name)
-        except AttributeError:
-            field_value = None
+            resolver = self.field_resolvers[name]
+        except KeyError:
+            resolver = field_resolver(self.settings['known_values'].get(name))
+        return resolver(raw_issue(issue)['fields'].get(field_name))
+
+    def decode_changelog(self, issue):
+        """Return the `ChangelogEvents` for an issue, or None if it was
+        fetched without its changelog.
+        """
 
-        if field_value is None:
-            return None
+        issue = raw_issue(issue)
 
-        value = getattr(field_value, 'value', field_value)
+        # If we have no size changes and the issue has a current size then a size must have ben specified at issue creation time.
         try:
-            child=field_value.child.value
-        except:
-            child = None
-        if child:
-            if isinstance(value, (basestring)):
-                value = value + "|"+child
-
-        if isinstance(value, (list, tuple)):
-            if len(value) == 0:
-                value = None
-            else:
-                values = [getattr(v, 'name', v) for v in value]
-                if name not in self.settings['known_values']:
-                    value = '|'.join([str(x) for x in values]) # values[0]
-                else:
-                    try:
-                        value = next(itertools.ifilter(lambda v: v in values, self.settings['known_values'][name]))
-                    except StopIteration:
-                        value = None
-        else:
-            if not isinstance(value, (int, float, bool, basestring)):
-                try:
-                    value = str(value)
-                except TypeError:
-                    pass
-            if isinstance(value, (basestring)):
-                regex = re.compile(r'^\d{4}[- ]?\d\d[- ]?\d\d[T ]\d\d:\d\d:\d\d[.+]\d{2,6}[+-:]\d{2,6}$')
-                #regex = re.compile(r'^\d{4}[- ]?\d\d[- ]?\d\d[T ]\d\d:\d\d:\d\d\.\d{3,6}[+-]\d{3,6}$')
-                if regex.match(value):
-                    #print('Got date formatted string! Converting to datetime!')
-                    value = dateutil.parser.parse(value)
-                    # Remove the timezone element as excel does not handle
-                    value = value.replace(tzinfo=None)
-
-        return value
+            current_size = issue['fields'][self.fields['StoryPoints']]
+        except KeyError:
+            current_size = None
+
+        return decode_changelog(issue, size_field=SIZE, current_size=current_size)
 
     def iter_size_changes(self, issue):
         """Yield an IssueSnapshot for each time the issue size changed
         """
 
-        # Find the first size change, if any
-        try:
-            size_changes = list(filter(lambda h: h.field == 'Story Points',
-                                       itertools.chain.from_iterable([c.items for c in issue.changelog.histories])))
-        except AttributeError:
+        changes = self.decode_changelog(issue)
+        if changes is None:
             return
 
-        # If we have no size changes and the issue has a current size then a size must have ben specified at issue creation time.
-        # Return the size at creation time
-
-        try:
-            current_size = issue.fields.__dict__[self.fields['StoryPoints']]
-        except:
-            current_size = None
-
-        size = (size_changes[0].fromString) if len(size_changes)  else current_size
-
         # Issue was created
         yield IssueSizeSnapshot(
             change=None,
-            key=issue.key,
-            date=dateutil.parser.parse(issue.fields.created),
-            size=size
+            key=changes.key,
+            date=changes.created,
+            size=changes.initial_size
         )
 
-        for change in issue.changelog.histories:
-            change_date = dateutil.parser.parse(change.created)
-
-            #sizes = list(filter(lambda i: i.field == 'Story Points', change.items))
-            #is_resolved = (sizes[-1].to is not None) if len(sizes) > 0 else is_resolved
-
-            for item in change.items:
-                if item.field == 'Story Points':
-                    # StoryPoints value was changed
-                    size = item.toString
-                    yield IssueSizeSnapshot(
-                        change=item.field,
-                        key=issue.key,
-                        date=change_date,
-                        size=size
-                    )
-
-
+        for date, field, value in zip(changes.dates, changes.fields, changes.values):
+            if field == SIZE:
+                # StoryPoints value was changed
+                yield IssueSizeSnapshot(
+                    change=field,
+                    key=changes.key,
+                    date=date,
+                    size=value
+                )
 
     def iter_changes(self, issue, include_resolution_changes=True):
         """Yield an IssueSnapshot for each time the issue changed status or
         resolution
         """
 
-        is_resolved = False
-
-        # Find the first status change, if any
-        try:
-            status_changes = list(filter(
-                lambda h: h.field == 'status',
-                itertools.chain.from_iterable([c.items for c in issue.changelog.histories])))
-        except AttributeError:
+        changes = self.decode_changelog(issue)
+        if changes is None:
             return
-        last_status = status_changes[0].fromString if len(status_changes) > 0 else issue.fields.status.name
+
+        last_status = changes.initial_status
         last_resolution = None
 
         # Issue was created
         yield IssueSnapshot(
             change=None,
-            key=issue.key,
-            date=dateutil.parser.parse(issue.fields.created),
+            key=changes.key,
+            date=changes.created,
             status=last_status,
             resolution=None,
-            is_resolved=is_resolved
+            is_resolved=False
         )
 
-        for change in issue.changelog.histories:
-            change_date = dateutil.parser.parse(change.created)
-
-            resolutions = list(filter(lambda i: i.field == 'resolution', change.items))
-            is_resolved = (resolutions[-1].to is not None) if len(resolutions) > 0 else is_resolved
-
-            for item in change.items:
-                if item.field == 'status':
-                    # Status was changed
-                    last_status = item.toString
+        for date, field, value, is_resolved in zip(changes.dates, changes.fields, changes.values, changes.resolved):
+            if field == STATUS:
+                # Status was changed
+                last_status = value
+                yield IssueSnapshot(
+                    change=field,
+                    key=changes.key,
+                    date=date,
+                    status=last_status,
+                    resolution=last_resolution,
+                    is_resolved=is_resolved
+                )
+            elif field == RESOLUTION:
+                last_resolution = value
+                if include_resolution_changes:
                     yield IssueSnapshot(
-                        change=item.field,
-                        key=issue.key,
-                        date=change_date,
+                        change=field,
+                        key=changes.key,
+                        date=date,
                         status=last_status,
                         resolution=last_resolution,
                         is_resolved=is_resolved
                     )
-                elif item.field == 'resolution':
-                    last_resolution = item.toString
-                    if include_resolution_changes:
-                        yield IssueSnapshot(
-                            change=item.field,
-                            key=issue.key,
-                            date=change_date,
-                            status=last_status,
-                            resolution=last_resolution,
-                            is_resolved=is_resolved
-                        )
 
     # Basic queries
 
@@ -250,6 +261,51 @@ class QueryManager(object):
         'jql_filter' set in the passed-in `criteria` object.
 
         Pass a JQL string to further qualify the query results.
+
+        If the `cache_jira` setting names a directory (or is `True`), issues
+        are stored there between runs and only issues updated since the
+        previous run are fetched in full.
+        """
+
+        try:
+            issues = list(self._iter_issues(criteria, jql, order, verbose, changelog))
+        except JIRAError as e:
+            print("Jira query error with: {}\n{}".format(self.query_string(criteria, jql, order), e))
+            return []
+
+        if verbose:
+            print("Fetched", len(issues), "issues")
+
+        return issues
+
+    def iter_issues(self, criteria={}, jql=None, order='KEY ASC', verbose=False, changelog=True):
+        """Yield the issues `find_issues` would return, one page at a time.
+
+        Issues are fetched a page at a time, so that callers which do not
+        keep the issues can process very large result sets with about one
+        page of issues in memory (or as many pages as `fetch_concurrency`).
+        With `Cache Jira` set, all cached issues for the query are held in
+        memory as well.
+
+        A `JIRAError` part way through is raised again once reported, rather
+        than ending the stream early as if all issues had been yielded.
+        """
+
+        count = 0
+        try:
+            for issue in self._iter_issues(criteria, jql, order, verbose, changelog):
+                count += 1
+                yield issue
+        except JIRAError as e:
+            print("Jira query error with: {}\n{}".format(self.query_string(criteria, jql, order), e))
+            raise
+
+        if verbose:
+            print("Fetched", count, "issues")
+
+    def query_string(self, criteria={}, jql=None, order=None):
+        """Return the JQL for the passed-in `criteria` and `jql`, ordered by
+        `order` if given.
         """
 
         query = []
@@ -269,32 +325,201 @@ class QueryManager(object):
         if jql is not None:
             query.append('(%s)' % jql)
 
-        queryString = "%s ORDER BY %s" % (' AND '.join(query), order,)
+        jqlString = ' AND '.join(query)
+        if order is None:
+            return jqlString
+        return "%s ORDER BY %s" % (jqlString, order,)
+
+    def _iter_issues(self, criteria, jql, order, verbose, changelog):
+        queryString = self.query_string(criteria, jql, order)
 
         if verbose:
             print("Fetching issues with query:", queryString)
 
-        fromRow=0
+        cache = self.issue_cache(queryString, changelog, self.search_fields())
+        if cache is None:
+            pages = self.iter_pages(queryString, verbose=verbose, changelog=changelog)
+        else:
+            pages = self.iter_cached_pages(cache, self.query_string(criteria, jql), order, verbose=verbose, changelog=changelog)
+
+        for page in pages:
+            for issue in page:
+                yield issue
+
+    def search(self, queryString, verbose=False, changelog=True, fields=None):
+        """Return all issues matching `queryString`
+        """
         issues = []
-        while True:
-            try:
-                if changelog:
-                    pageofissues = self.jira.search_issues(queryString, expand='changelog', maxResults=self.settings['max_results'],startAt=fromRow)
-                else:
-                    pageofissues = self.jira.search_issues(queryString, maxResults=self.settings['max_results'],startAt=fromRow)
-
-                fromRow = fromRow + int(self.settings['max_results'])
-                issues += pageofissues
-                if verbose:
-                    print("Got %s lines per jira query from result starting at line number %s " % (self.settings['max_results'],  fromRow))
-                if len(pageofissues)==0:
-                    break
-            except JIRAError as e:
-                print("Jira query error with: {}\n{}".format(queryString, e))
-                return []
+        for pageofissues in self.iter_pages(queryString, verbose=verbose, changelog=changelog, fields=fields):
+            issues += pageofissues
+        return issues
+
+    def iter_pages(self, queryString, verbose=False, changelog=True, fields=None):
+        """Yield the issues matching `queryString` one page of `max_results`
+        issues at a time.
+
+        Only the `fields` given are requested, by default `search_fields()`.
+
+        If the `fetch_concurrency` setting is greater than one, the first page
+        is used to find the total number of issues and the remaining pages
+        are fetched by a pool of that many threads, that many pages at a time.
 
+        JIRA may send back fewer issues per page than asked for (JIRA Cloud
+        caps `maxResults`), so later pages start after the number of issues
+        actually received on the first.
+
+        Issues that change while pages are fetched can move between pages,
+        so an issue already yielded is skipped if it turns up again. If
+        fewer issues than the total were seen, the pages are fetched once
+        more for those that were missed, and `IncompleteResults` is raised
+        if JIRA still returns fewer issues than it reports.
+        """
+
+        page_size = int(self.settings['max_results'])
+        concurrency = int(self.settings['fetch_concurrency'] or 1)
+        if fields is None:
+            fields = self.search_fields()
+
+        def fetch_page(startAt):
+            if self.settings['raw_json']:
+                pageofissues = self.search_raw(queryString, startAt, page_size, changelog=changelog, fields=fields)
+            else:
+                pageofissues = self.jira.search_issues(queryString, expand='changelog' if changelog else None, fields=fields, maxResults=page_size, startAt=startAt)
+            if verbose:
+                print("Got %s lines per jira query from result starting at line number %s " % (len(pageofissues), startAt))
+            return pageofissues
+
+        def serial_pages(pageofissues):
+            fromRow = len(pageofissues)
+            while len(pageofissues) > 0:
+                pageofissues = fetch_page(fromRow)
+                fromRow = fromRow + len(pageofissues)
+                yield pageofissues
+
+        seen = set()
+
+        def unseen(pageofissues):
+            keys = [raw_issue(issue)['key'] for issue in pageofissues]
+            page = [issue for issue, key in zip(pageofissues, keys) if key not in seen]
+            seen.update(keys)
+            return page
+
+        pageofissues = fetch_page(0)
+        total = getattr(pageofissues, 'total', None)
+        step = len(pageofissues)
+        yield unseen(pageofissues)
+
+        if concurrency > 1 and total is not None and step > 0:
+            offsets = list(range(step, total, step))
+            if len(offsets) > 0:
+                pool = ThreadPool(min(concurrency, len(offsets)))
+                try:
+                    for i in range(0, len(offsets), concurrency):
+                        for pageofissues in pool.map(fetch_page, offsets[i:i + concurrency]):
+                            yield unseen(pageofissues)
+                finally:
+                    pool.close()
+                    pool.join()
+        else:
+            for pageofissues in serial_pages(pageofissues):
+                yield unseen(pageofissues)
+
+        if total is None or len(seen) >= total:
+            return
 
         if verbose:
-            print("Fetched", len(issues), "issues")
+            print("Fetching issues again after receiving %d of %d" % (len(seen), total))
 
-        return issues
+        pageofissues = fetch_page(0)
+        total = getattr(pageofissues, 'total', total)
+        received = set()
+        for pageofissues in itertools.chain([pageofissues], serial_pages(pageofissues)):
+            received.update(raw_issue(issue)['key'] for issue in pageofissues)
+            yield unseen(pageofissues)
+
+        if len(received) < total:
+            raise IncompleteResults("Expected %d issues from JIRA but received %d with query: %s" % (total, len(received), queryString))
+
+    def search_raw(self, queryString, startAt, maxResults, changelog=True, fields=None):
+        """Return one page of issues matching `queryString` as a list of raw
+        JSON dicts, skipping the construction of `jira` resources.
+
+        The list has a `total` attribute like the pages returned by
+        `jira.search_issues()`.
+        """
+
+        params = {
+            'jql': queryString,
+            'startAt': startAt,
+            'maxResults': maxResults,
+        }
+        if changelog:
+            params['expand'] = 'changelog'
+        if fields is not None:
+            params['fields'] = fields if isinstance(fields, basestring) else ','.join(fields)
+
+        # The session raises a JIRAError for unsuccessful responses
+        response = self.jira._session.get(self.jira._get_url('search'), params=params)
+        data = json_loads(response.content)
+
+        page = RawPage(data['issues'])
+        page.total = data.get('total')
+        return page
+
+    # Issue cache
+
+    def issue_cache(self, queryString, changelog=True, fields=None):
+        """Return the `IssueCache` for this query and set of fields, or None
+        if the `Cache Jira` setting is not set.
+        """
+        directory = cache_directory(self.settings['cache_jira'])
+        if directory is None:
+            return None
+        return IssueCache.for_query(directory, self.jira._options['server'], queryString, changelog, fields)
+
+    def iter_cached_pages(self, cache, jql, order, verbose=False, changelog=True):
+        """Yield pages of the issues matching `jql`, only fetching those
+        updated since the last run in full.
+
+        The keys of all matching issues are fetched on every run so that
+        issues which have been deleted, or no longer match the query, are
+        dropped from the cache, and so that issues are returned in `order`.
+        Issues can also come to match the query without being updated (e.g.
+        through `openSprints()` or a relative date), so any matching issue
+        not yet in the cache is fetched in full by key.
+        """
+
+        if cache.watermark is None:
+            for pageofissues in self.iter_pages("%s ORDER BY %s" % (jql, order,), verbose=verbose, changelog=changelog):
+                cache.merge(raw_issue(issue) for issue in pageofissues)
+                yield pageofissues
+            cache.save()
+            return
+
+        updatedQueryString = "%s AND %s ORDER BY %s" % (jql, cache.since_jql(), order,)
+        if verbose:
+            print("Fetching issues updated since", cache.watermark, "with query:", updatedQueryString)
+
+        updated = self.search(updatedQueryString, verbose=verbose, changelog=changelog)
+        keys = [raw_issue(issue)['key'] for issue in self.search("%s ORDER BY %s" % (jql, order,), verbose=verbose, changelog=False, fields='key')]
+
+        cache.merge(raw_issue(issue) for issue in updated)
+        cache.retain(keys)
+
+        page_size = int(self.settings['max_results'])
+        missing = [key for key in keys if key not in cache.issues]
+        for i in range(0, len(missing), page_size):
+            missingQueryString = "key IN (%s)" % ', '.join(['"%s"' % key for key in missing[i:i + page_size]])
+            cache.merge(raw_issue(issue) for issue in self.search(missingQueryString, verbose=verbose, changelog=changelog))
+        cache.save()
+
+        if verbose:
+            print("Merged", len(updated), "updated and", len(missing), "newly matching issues into", len(cache.issues), "cached issues")
+
+        # Issues deleted since their keys were fetched are skipped
+        keys = [key for key in keys if key in cache.issues]
+        for i in range(0, len(keys), page_size):
+            if self.settings['raw_json']:
+                yield [cache.issues[key] for key in keys[i:i + page_size]]
+            else:
+                yield [Issue(self.jira._options, self.jira._session, raw=cache.issues[key]) for key in keys[i:i + page_size]]
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+
+from .arrays import expand_intervals
+
+
+def issue_sort_key(key):
+    """Sort JIRA issue keys by project, then by issue number
+    """
+    return key.split('-')[0] + '-' + str(int(key.split('-')[1])).zfill(6)
+
+
+def day_numbers(values):
+    """Return datetimes as whole days since the epoch
+    """
+    return np.asarray(values, dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+
+
+def day_number(value):
+    """Return a date, datetime or date string as a whole day since the epoch
+    """
+    return int(np.datetime64(pd.Timestamp(value).to_datetime64(), 'D').astype(np.int64))
+
+
+def size_cells(size_data):
+    """Work out the size of each issue on each day from a table of size
+    intervals with columns `key`, `fromDate`, `toDate` (both inclusive) and
+    `size`.
+
+    All intervals are expanded to days at once. Where intervals of the same
+    issue overlap, the first of them (in the order of `size_data`) with a
+    size wins; days covered only by intervals without a size are NaN.
+
+    Returns `(keys, first_day, num_days, columns, days, sizes)`: the issue
+    keys, sorted by `issue_sort_key()`, the first day covered and the number
+    of days up to the last, and for each issue and day covered (sorted by
+    issue, then day) the index of the issue in `keys`, the day relative to
+    `first_day`, and the size.
+    """
+
+    keys = sorted(set(size_data['key']), key=issue_sort_key)
+    column_of = dict((key, i) for i, key in enumerate(keys))
+    columns = np.array([column_of[key] for key in size_data['key']], dtype=np.int64)
+    sizes = pd.to_numeric(pd.Series(np.asarray(size_data['size'])), errors='coerce').values.astype(float)
+
+    rows, days = expand_intervals(day_numbers(size_data['fromDate']), day_numbers(size_data['toDate']))
+    if len(days) == 0:
+        empty = np.array([], dtype=np.int64)
+        return keys, 0, 0, empty, empty, np.array([], dtype=float)
+
+    first_day = int(days.min())
+    num_days = int(days.max()) - first_day + 1
+
+    # One cell per issue and day, ordered by issue then day
+    cells = columns[rows] * num_days + (days - first_day)
+    covered = np.sort(cells)
+    covered = covered[np.append(True, covered[1:] != covered[:-1])]
+
+    # The first sized interval covering a cell wins
+    values = np.full(len(covered), np.nan)
+    sized = ~np.isnan(sizes[rows])
+    sized_cells, first = np.unique(cells[sized], return_index=True)
+    values[np.searchsorted(covered, sized_cells)] = sizes[rows[sized][first]]
+
+    cell_columns, cell_days = np.divmod(covered, num_days)
+    return keys, first_day, num_days, cell_columns, cell_days, values
+
+
+def dense_frame(keys, first_day, num_days, columns, days, sizes):
+    """Return a DataFrame indexed by day with a column for each of `keys`,
+    from the cells returned by `size_cells()`. Days that no cell covers
+    repeat the day before.
+    """
+
+    if len(keys) == 0:
+        return pd.DataFrame()
+    if num_days == 0:
+        return pd.DataFrame(columns=keys)
+
+    matrix = np.full((num_days, len(keys)), np.nan)
+    matrix[days, columns] = sizes
+
+    covered = np.zeros(num_days, dtype=bool)
+    covered[days] = True
+    if not covered.all():
+        matrix = matrix[np.maximum.accumulate(np.where(covered, np.arange(num_days), 0))]
+
+    index = pd.date_range(np.datetime64(first_day, 'D'), periods=num_days, freq='D')
+    return pd.DataFrame(matrix, index=index, columns=keys)
+
+
+def size_history_frame(size_data):
+    """Return a DataFrame indexed by day, with a column for each issue key
+    holding its size on that day (see `size_cells()`).
+    """
+    return dense_frame(*size_cells(size_data))
+
+
+class SizeHistory(object):
+    """The size of each issue over time, stored as runs of days with the same
+    size rather than as a day by issue matrix.
+
+    Initialise with a table of size intervals, as for `size_cells()`. Use
+    `sizes_on()` to look up the size of issues on a given day, and
+    `to_frame()` for the same DataFrame as `size_history_frame()`.
+    """
+
+    def __init__(self, size_data):
+        keys, first_day, num_days, columns, days, sizes = size_cells(size_data)
+
+        self.keys = keys
+        self.first_day = first_day
+        self.num_days = num_days
+        self.column_of = dict((key, i) for i, key in enumerate(keys))
+
+        # A run starts where the issue or the size changes, or after a gap
+        new_run = np.ones(len(days), dtype=bool)
+        same_size = (sizes[1:] == sizes[:-1]) | (np.isnan(sizes[1:]) & np.isnan(sizes[:-1]))
+        new_run[1:] = (columns[1:] != columns[:-1]) | (days[1:] != days[:-1] + 1) | ~same_size
+
+        starts = np.flatnonzero(new_run)
+        ends = np.append(starts[1:], len(days)) - 1
+
+        self.columns = columns[starts]
+        self.starts = days[starts]
+        self.ends = days[ends]
+        self.sizes = sizes[starts]
+
+        # Runs are sorted by issue, then start day, so that this is sorted too
+        self.run_keys = (self.columns << 32) + self.starts
+
+        # Days that any cell covers; other days take the sizes of the last of these
+        covered = np.sort(days)
+        self.covered_days = covered[np.append(True, covered[1:] != covered[:-1])] if len(covered) > 0 else covered
+
+    def __len__(self):
+        return len(self.starts)
+
+    def columns_of(self, keys):
+        """Return the index of each of `keys` in `self.keys`, or -1 if there
+        is no size history for it.
+        """
+        return np.array([self.column_of.get(key, -1) for key in keys], dtype=np.int64)
+
+    def sizes_at(self, day, columns):
+        """Return the sizes on a day (relative to `first_day`) of the issues
+        with the given column indexes, as an array. Issues without a size on
+        that day are NaN.
+
+        As in `to_frame()`, a day that no issue has a size interval for
+        repeats the last day before it that has one.
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        result = np.full(len(columns), np.nan)
+
+        known = columns >= 0
+        if len(self.starts) == 0 or not known.any() or day < 0 or day >= self.num_days:
+            return result
+
+        day = self.covered_days[np.searchsorted(self.covered_days, day, side='right') - 1]
+
+        columns = columns[known]
+        runs = np.searchsorted(self.run_keys, (columns << 32) + day, side='right') - 1
+        found = runs >= 0
+        runs = np.maximum(runs, 0)
+        found &= (self.columns[runs] == columns) & (self.ends[runs] >= day)
+
+        result[np.flatnonzero(known)[found]] = self.sizes[runs[found]]
+        return result
+
+    def sizes_on(self, date, keys=None):
+        """Return a Series of the sizes of issues on a date, indexed by key.
+        By default all issues are included.
+        """
+        if keys is None:
+            keys = self.keys
+        keys = list(keys)
+        return pd.Series(self.sizes_at(day_number(date) - self.first_day, self.columns_of(keys)), index=keys)
+
+    def to_frame(self):
+        """Return the sizes as a DataFrame indexed by day, with a column per
+        issue (see `size_history_frame()`).
+        """
+        rows, days = expand_intervals(self.starts, self.ends)
+        return dense_frame(self.keys, self.first_day, self.num_days, self.columns[rows], days, self.sizes[rows])
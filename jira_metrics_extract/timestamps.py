@@ -0,0 +1,77 @@
+import datetime
+import dateutil.parser
+import dateutil.tz
+
+# Number of parsed timestamps to remember before starting afresh
+MEMO_SIZE = 50000
+
+_memo = {}
+_time_zones = {}
+
+
+def parse_timestamp(value):
+    """Parse a JIRA timestamp such as `2017-07-10T09:21:57.112+0100`, or the
+    same without the milliseconds and time zone, into a datetime.
+
+    JIRA always uses this fixed format, so it is parsed by position, falling
+    back to `dateutil.parser.parse()` for anything else. Results are
+    remembered, as the same timestamps recur across issues and changes.
+    """
+
+    try:
+        return _memo[value]
+    except KeyError:
+        pass
+
+    try:
+        result = _parse_fixed(value)
+    except (ValueError, TypeError, IndexError):
+        result = None
+    if result is None:
+        result = dateutil.parser.parse(value)
+
+    if len(_memo) >= MEMO_SIZE:
+        _memo.clear()
+    _memo[value] = result
+
+    return result
+
+
+def _parse_fixed(value):
+    length = len(value)
+    if length != 28 and length != 19:
+        return None
+    if value[4] != '-' or value[7] != '-' or value[10] not in 'T ' or value[13] != ':' or value[16] != ':':
+        return None
+
+    year, month, day = int(value[0:4]), int(value[5:7]), int(value[8:10])
+    hour, minute, second = int(value[11:13]), int(value[14:16]), int(value[17:19])
+
+    if length == 19:
+        return datetime.datetime(year, month, day, hour, minute, second)
+
+    if value[19] != '.':
+        return None
+
+    return datetime.datetime(year, month, day, hour, minute, second, int(value[20:23]) * 1000, time_zone(value[23:]))
+
+
+def time_zone(offset):
+    """Return a tzinfo for a `+HHMM` or `-HHMM` offset
+    """
+
+    try:
+        return _time_zones[offset]
+    except KeyError:
+        pass
+
+    if offset[0] not in '+-':
+        raise ValueError("Invalid time zone offset: %s" % offset)
+
+    seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+    if offset[0] == '-':
+        seconds = -seconds
+
+    tz = dateutil.tz.tzutc() if seconds == 0 else dateutil.tz.tzoffset(None, seconds)
+    _time_zones[offset] = tz
+    return tz
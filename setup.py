@@ -48,6 +48,7 @@ setup(
 
     extras_require={
         'charting': ['seaborn', 'matplotlib', 'statsmodels'],
+        'fastjson': ['orjson'],
     },
 
     entry_points={
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import numpy as np
+from jira_metrics_extract.arrays import floor_days, group_ids, grouped_shift, expand_intervals, backfill_rows, rightmost_index, keep_rightmost
+
+class FloorDaysTest(unittest.TestCase):
+
+    def test_floor(self):
+        values = np.array(['2018-01-02T23:59:59', 'NaT', '2018-01-03T00:00:00'], dtype='datetime64[ns]')
+        expected = np.array(['2018-01-02', 'NaT', '2018-01-03'], dtype='datetime64[ns]')
+        np.testing.assert_array_equal(floor_days(values), expected)
+
+class GroupedShiftTest(unittest.TestCase):
+
+    def test_shift(self):
+        groups = group_ids(np.array([True, False, False, True, True, False]))
+        shifted = grouped_shift(np.array([1, 2, 3, 4, 5, 6]), groups, 0)
+        np.testing.assert_array_equal(shifted, [2, 3, 0, 0, 6, 0])
+
+    def test_empty(self):
+        self.assertEqual(len(grouped_shift(np.array([]), np.array([]), 0)), 0)
+
+class ExpandIntervalsTest(unittest.TestCase):
+
+    def test_expand(self):
+        rows, points = expand_intervals([5, 1, 3], [7, 0, 3])
+        np.testing.assert_array_equal(rows, [0, 0, 0, 2])
+        np.testing.assert_array_equal(points, [5, 6, 7, 3])
+
+class BackfillRowsTest(unittest.TestCase):
+
+    def test_backfill(self):
+        values = np.array([[1, 0, 3, 0], [0, 0, 0, 0]])
+        filled = backfill_rows(values, values == 0, -1)
+        np.testing.assert_array_equal(filled, [[1, 3, 3, -1], [-1, -1, -1, -1]])
+
+class RightmostTest(unittest.TestCase):
+
+    def test_rightmost_index(self):
+        mask = np.array([[True, False, True], [False, False, False], [False, True, False]])
+        np.testing.assert_array_equal(rightmost_index(mask), [2, -1, 1])
+
+    def test_keep_rightmost(self):
+        values = np.array([[1, 2, 0], [0, 0, 0], [3, 0, 0]])
+        np.testing.assert_array_equal(keep_rightmost(values), [[0, 2, 0], [0, 0, 0], [3, 0, 0]])
+
+if __name__ == '__main__':
+    unittest.main()
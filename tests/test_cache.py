@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+import shutil
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from jira_metrics_extract.cache import IssueCache
+
+def issue(key, updated, summary=''):
+    return {'key': key, 'fields': {'updated': updated, 'summary': summary}}
+
+class IssueCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'issues.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_merge(self):
+        cache = IssueCache(self.path)
+        self.assertIsNone(cache.watermark)
+        self.assertIsNone(cache.since_jql())
+
+        cache.merge([issue('PRJ-1', '2018-01-05T10:00:00.000+0000'), issue('PRJ-2', '2018-01-03T10:00:00.000+0000')])
+        self.assertEqual(cache.watermark, '2018-01-05T10:00:00.000+0000')
+
+        # An older issue replaces its cached copy, but not the watermark
+        cache.merge([issue('PRJ-2', '2018-01-04T10:00:00.000+0000', 'Changed')])
+        self.assertEqual(cache.watermark, '2018-01-05T10:00:00.000+0000')
+        self.assertEqual(cache.issues['PRJ-2']['fields']['summary'], 'Changed')
+        self.assertEqual(sorted(cache.issues.keys()), ['PRJ-1', 'PRJ-2'])
+
+    def test_retain(self):
+        cache = IssueCache(self.path)
+        cache.merge([issue('PRJ-%d' % i, '2018-01-05T10:00:00.000+0000') for i in range(3)])
+
+        cache.retain(['PRJ-0', 'PRJ-2', 'PRJ-9'])
+        self.assertEqual(sorted(cache.issues.keys()), ['PRJ-0', 'PRJ-2'])
+
+    def test_since_jql(self):
+        cache = IssueCache(self.path)
+        cache.merge([issue('PRJ-1', '2018-03-01T00:30:00.000+0100')])
+
+        # A day before the watermark, to allow for the time zone of the JIRA user
+        self.assertEqual(cache.since_jql(), 'updated >= "2018/02/28"')
+
+    def test_save(self):
+        cache = IssueCache(self.path)
+        cache.merge([issue('PRJ-1', '2018-01-05T10:00:00.000+0000')])
+        cache.save()
+
+        cache = IssueCache(self.path)
+        self.assertEqual(cache.watermark, '2018-01-05T10:00:00.000+0000')
+        self.assertEqual(list(cache.issues.keys()), ['PRJ-1'])
+
+if __name__ == '__main__':
+    unittest.main()
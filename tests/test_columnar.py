@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+import datetime
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import dateutil.tz
+import pandas as pd
+from jira_metrics_extract.columnar import ColumnarBuilder, OBJECT, CATEGORY, DATETIME, TIMEDELTA
+
+class ColumnarBuilderTest(unittest.TestCase):
+
+    def build(self, rows):
+        builder = ColumnarBuilder([
+            ('key', OBJECT),
+            ('status', CATEGORY),
+            ('when', DATETIME),
+            ('took', TIMEDELTA),
+        ], capacity=2)
+        for row in rows:
+            builder.append(row)
+        return builder.to_frame()
+
+    def test_values(self):
+        df = self.build([
+            {'key': 'A-1', 'status': 'Open', 'when': datetime.datetime(2018, 1, 2, 3, 4, 5), 'took': datetime.timedelta(days=2)},
+            {'key': 'A-2', 'status': 'Done', 'when': datetime.datetime(2018, 1, 2, 12, tzinfo=dateutil.tz.tzoffset(None, 3600))},
+            {'key': 'A-3', 'status': 'Open', 'when': '2018-01-03T00:00:00', 'ignored': 1},
+            {'key': None, 'status': None, 'when': None},
+        ])
+
+        self.assertEqual(list(df.columns), ['key', 'status', 'when', 'took'])
+        self.assertEqual(df['key'].tolist()[:3], ['A-1', 'A-2', 'A-3'])
+        self.assertTrue(pd.isnull(df['key'][3]))
+        self.assertEqual(df['status'].tolist()[:3], ['Open', 'Done', 'Open'])
+        self.assertTrue(pd.isnull(df['status'][3]))
+        self.assertEqual(df['when'][0], pd.Timestamp('2018-01-02 03:04:05'))
+        self.assertEqual(df['when'][1], pd.Timestamp('2018-01-02 11:00:00'))  # converted to UTC
+        self.assertEqual(df['when'][2], pd.Timestamp('2018-01-03'))
+        self.assertTrue(pd.isnull(df['when'][3]))
+        self.assertEqual(df['took'][0], pd.Timedelta(days=2))
+        self.assertTrue(pd.isnull(df['took'][1]))
+
+    def test_empty(self):
+        df = self.build([])
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), ['key', 'status', 'when', 'took'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+import datetime
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from jira_metrics_extract.fields import field_index, field_resolver
+
+class FieldIndexTest(unittest.TestCase):
+
+    def test_index(self):
+        index = field_index([
+            {'name': 'Story Points', 'id': 'customfield_10002'},
+            {'name': 'story points', 'id': 'customfield_10003'},
+            {'name': 'Summary', 'id': 'summary'},
+        ])
+        self.assertEqual(index, {'story points': 'customfield_10002', 'summary': 'summary'})
+
+class FieldResolverTest(unittest.TestCase):
+
+    def test_option(self):
+        resolve = field_resolver()
+        self.assertEqual(resolve({'self': 'https://jira/option/1', 'value': 'Team A', 'id': '1'}), 'Team A')
+
+    def test_cascading_option(self):
+        resolve = field_resolver()
+        self.assertEqual(resolve({'value': 'Europe', 'child': {'value': 'France', 'id': '2'}}), 'Europe|France')
+        # A child without a value is ignored
+        self.assertEqual(resolve({'value': 'Europe', 'child': {}}), 'Europe')
+
+    def test_object(self):
+        resolve = field_resolver()
+        self.assertEqual(resolve({'displayName': 'Jane Doe', 'name': 'jdoe'}), 'Jane Doe')
+        self.assertEqual(resolve({'name': 'Sprint 1', 'id': 7}), 'Sprint 1')
+
+    def test_list(self):
+        resolve = field_resolver()
+        self.assertEqual(resolve([{'name': 'frontend'}, {'name': 'api'}]), 'frontend|api')
+        self.assertEqual(resolve(['frontend', 'api']), 'frontend|api')
+        self.assertEqual(resolve([{'value': 'Team A'}]), 'Team A')
+        self.assertIsNone(resolve([]))
+
+    def test_known_values(self):
+        resolve = field_resolver(['High', 'Medium', 'Low'])
+        # The known value listed first wins, whatever the order in the issue
+        self.assertEqual(resolve(['Low', 'other', 'Medium']), 'Medium')
+        self.assertEqual(resolve([{'name': 'Low'}]), 'Low')
+        self.assertIsNone(resolve(['other']))
+
+    def test_date_string(self):
+        resolve = field_resolver()
+        self.assertEqual(resolve('2018-01-05T10:20:30.000+0100'), datetime.datetime(2018, 1, 5, 10, 20, 30))
+        self.assertEqual(resolve('2018-01-05'), '2018-01-05')
+        self.assertEqual(resolve('Some text'), 'Some text')
+
+    def test_scalars(self):
+        resolve = field_resolver()
+        self.assertIsNone(resolve(None))
+        self.assertEqual(resolve(3.0), 3.0)
+        self.assertEqual(resolve(5), 5)
+        self.assertIs(resolve(True), True)
+
+if __name__ == '__main__':
+    unittest.main()
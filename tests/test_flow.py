@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+import shutil
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import numpy as np
+import pandas as pd
+from jira_metrics_extract.flow import CfdTrace, cumulative_flow, entry_days, flow_sizes
+
+NaT = pd.NaT
+DATES = pd.DataFrame({
+    'todo': pd.to_datetime(['2018-01-01 10:00', '2018-01-02 00:00', '2018-01-02 00:00']),
+    'doing': pd.to_datetime(['2018-01-03 09:00', NaT, NaT]),
+    'done': pd.to_datetime([NaT, '2018-01-05 00:00', NaT]),
+}, columns=['todo', 'doing', 'done'])
+
+class CumulativeFlowTest(unittest.TestCase):
+
+    def test_unstacked(self):
+        df = cumulative_flow(DATES, stacked=False)
+
+        self.assertEqual(list(df.columns), ['todo', 'doing', 'done'])
+        self.assertEqual(list(df.index), list(pd.date_range('2018-01-01', '2018-01-05')))
+        # The skipped `doing` state of the second issue takes the `done` date
+        np.testing.assert_array_equal(df.values, [
+            [1, 0, 0],
+            [3, 0, 0],
+            [3, 1, 0],
+            [3, 1, 0],
+            [3, 2, 1],
+        ])
+
+    def test_stacked(self):
+        df = cumulative_flow(DATES, stacked=True)
+        np.testing.assert_array_equal(df.values, [
+            [1, 0, 0],
+            [3, 0, 0],
+            [2, 1, 0],
+            [2, 1, 0],
+            [1, 1, 1],
+        ])
+
+    def test_empty(self):
+        df = cumulative_flow(DATES.iloc[:0])
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), ['todo', 'doing', 'done'])
+
+class FlowSizesTest(unittest.TestCase):
+
+    def test_sizes(self):
+        days = entry_days(DATES)
+        on_day = days[0, 1]  # 2018-01-03
+        sizes = np.array([3.0, 5.0, np.nan])
+
+        np.testing.assert_array_equal(flow_sizes(days, on_day, sizes, stacked=False), [8, 3, 0])
+        np.testing.assert_array_equal(flow_sizes(days, on_day, sizes, stacked=True), [5, 3, 0])
+
+class CfdTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_trace(self):
+        path = os.path.join(self.directory, 'trace.tsv')
+        trace = CfdTrace(path)
+        trace.add(pd.Timestamp('2018-01-02'), ['A-1', 'A-2', 'A-3'], ['doing', None, 'todo'], [3.0, 5.0, np.nan])
+        trace.close()
+
+        with open(path) as f:
+            self.assertEqual(f.read(), 'date\tkey\tstate\tsize\n'
+                                       '2018-01-02T00:00:00\tA-1\tdoing\t3.0\n'
+                                       '2018-01-02T00:00:00\tA-3\ttodo\t\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import numpy as np
+import pandas as pd
+from jira_metrics_extract.montecarlo import TRIALS_PER_CHUNK, adaptive_simulate, chunk_trials, finish_dates, parallel_simulate, parallel_simulate_bands, segment_simulation, simulate, simulate_bands, steps_until, trials_frame
+
+SAMPLES = np.array([0.0, 1.0, 2.0, 3.0])
+
+class SimulateTest(unittest.TestCase):
+
+    def test_paths(self):
+        steps, paths = simulate(5, 20, SAMPLES, 50, random_state=1, steps_per_block=3, keep_paths=True)
+
+        self.assertEqual(paths.shape, (50, steps.max() + 1))
+        for trial in range(50):
+            path = paths[trial, :steps[trial] + 1]
+            self.assertEqual(path[0], 5)
+            self.assertTrue(np.isin(np.diff(path), SAMPLES).all())
+            # The target is first reached on the last step
+            self.assertGreaterEqual(path[-1], 20)
+            self.assertTrue((path[:-1] < 20).all())
+            self.assertTrue(np.isnan(paths[trial, steps[trial] + 1:]).all())
+
+    def test_reproducible(self):
+        first = simulate(0, 50, SAMPLES, 100, random_state=7)
+        second = simulate(0, 50, SAMPLES, 100, random_state=np.random.RandomState(7))
+        np.testing.assert_array_equal(first, second)
+        # The block size does not change the samples drawn for a single trial
+        np.testing.assert_array_equal(simulate(0, 50, SAMPLES, 1, random_state=7, steps_per_block=200),
+                                      simulate(0, 50, SAMPLES, 1, random_state=7, steps_per_block=50))
+
+    def test_already_done(self):
+        steps, paths = simulate(10, 10, SAMPLES, 3, keep_paths=True)
+        np.testing.assert_array_equal(steps, [0, 0, 0])
+        np.testing.assert_array_equal(paths, [[10], [10], [10]])
+
+class SimulateBandsTest(unittest.TestCase):
+
+    def test_bands(self):
+        steps, paths = simulate(5, 20, SAMPLES, 50, random_state=1, steps_per_block=3, keep_paths=True)
+        band_steps, bands = simulate_bands(5, 20, SAMPLES, 50, [0.1, 0.5, 0.9], random_state=1, steps_per_block=3)
+
+        np.testing.assert_array_equal(band_steps, steps)
+        # Finished trials stay at the target
+        clipped = np.where(np.isnan(paths), 20, np.minimum(paths, 20))
+        np.testing.assert_allclose(bands, np.percentile(clipped, [10, 50, 90], axis=0))
+
+class ParallelSimulateTest(unittest.TestCase):
+
+    def test_chunks(self):
+        self.assertEqual(chunk_trials(0), [])
+        self.assertEqual(chunk_trials(TRIALS_PER_CHUNK * 2 + 1), [TRIALS_PER_CHUNK, TRIALS_PER_CHUNK, 1])
+
+    def test_repeatable(self):
+        trials = TRIALS_PER_CHUNK + 100
+        serial = parallel_simulate(0, 10, SAMPLES, trials, seed=3)
+        pooled = parallel_simulate(0, 10, SAMPLES, trials, seed=3, processes=2)
+
+        self.assertEqual(len(serial), trials)
+        np.testing.assert_array_equal(serial, pooled)
+        # The first chunk has a stream of its own
+        np.testing.assert_array_equal(serial[:TRIALS_PER_CHUNK], simulate(0, 10, SAMPLES, TRIALS_PER_CHUNK, random_state=np.random.RandomState([3, 0])))
+
+    def test_paths_match_steps(self):
+        steps = parallel_simulate(5, 20, SAMPLES, 120, seed=4, chunk_size=50)
+        path_steps, paths = parallel_simulate(5, 20, SAMPLES, 120, seed=4, chunk_size=50, keep_paths=True)
+
+        np.testing.assert_array_equal(path_steps, steps)
+        self.assertEqual(paths.shape, (120, steps.max() + 1))
+        # Each trial's path stops on the step it reached the target
+        for trial in range(120):
+            self.assertGreaterEqual(paths[trial, steps[trial]], 20)
+            self.assertTrue(np.isnan(paths[trial, steps[trial] + 1:]).all())
+
+    def test_bands_match_paths(self):
+        steps, paths = parallel_simulate(5, 20, SAMPLES, 120, seed=4, chunk_size=50, keep_paths=True)
+        band_steps, bands = parallel_simulate_bands(5, 20, SAMPLES, 120, [0.1, 0.5, 0.9], seed=4, processes=2, chunk_size=50)
+
+        np.testing.assert_array_equal(band_steps, steps)
+        clipped = np.where(np.isnan(paths), 20, np.minimum(paths, 20))
+        np.testing.assert_allclose(bands, np.percentile(clipped, [10, 50, 90], axis=0))
+
+class AdaptiveSimulateTest(unittest.TestCase):
+
+    def test_settles(self):
+        steps, settled = adaptive_simulate(0, 50, SAMPLES, [0.5, 0.85], 0.5, batch_trials=100, seed=3)
+
+        self.assertTrue(settled)
+        self.assertEqual(len(steps) % 100, 0)
+        # The batches are the same as running that many trials in one go
+        np.testing.assert_array_equal(steps[:100], simulate(0, 50, SAMPLES, 100, random_state=np.random.RandomState([3, 0])))
+
+    def test_ceiling(self):
+        steps, settled = adaptive_simulate(0, 50, SAMPLES, [0.5, 0.85], 0, batch_trials=100, max_trials=250, seed=3)
+
+        self.assertEqual(len(steps), 250)
+        self.assertFalse(settled)
+
+    def test_repeatable(self):
+        serial, _ = adaptive_simulate(0, 50, SAMPLES, [0.5, 0.85], 0.2, batch_trials=50, seed=3)
+        pooled, _ = adaptive_simulate(0, 50, SAMPLES, [0.5, 0.85], 0.2, batch_trials=50, seed=3, processes=2)
+        np.testing.assert_array_equal(serial, pooled)
+
+    def test_rerun(self):
+        steps, _ = adaptive_simulate(0, 50, SAMPLES, [0.5, 0.85], 0, batch_trials=100, max_trials=250, seed=3)
+        path_steps, paths = parallel_simulate(0, 50, SAMPLES, len(steps), seed=3, chunk_size=100, keep_paths=True)
+        band_steps, bands = parallel_simulate_bands(0, 50, SAMPLES, len(steps), [0.5], seed=3, chunk_size=100)
+
+        # The same trials can be run again with their paths or bands
+        np.testing.assert_array_equal(path_steps, steps)
+        np.testing.assert_array_equal(band_steps, steps)
+
+class SegmentSimulationTest(unittest.TestCase):
+
+    def test_segments(self):
+        samples = [SAMPLES, np.array([2.0]), np.array([0.0, 0.0]), SAMPLES]
+        steps, done_by = segment_simulation([20, 7, 5, 0], samples, 100, by_step=2, random_state=1)
+
+        self.assertEqual(steps.shape, (4, 100))
+        self.assertTrue((steps[0] >= 7).all())
+        # A constant throughput of 2 finishes 7 items on the 4th step
+        self.assertTrue((steps[1] == 4).all())
+        # No throughput never finishes; nothing remaining is done at once
+        self.assertTrue((steps[2] == -1).all())
+        self.assertTrue((steps[3] == 0).all())
+
+        np.testing.assert_array_equal(done_by[1], 4)
+        np.testing.assert_array_equal(done_by[2], 0)
+        np.testing.assert_array_equal(done_by[3], 0)
+        self.assertTrue(np.isin(done_by[0], np.arange(7)).all())
+
+    def test_steps_until(self):
+        day = pd.tseries.frequencies.to_offset('D')
+        self.assertEqual(steps_until(pd.Timestamp('2018-01-01'), day, pd.Timestamp('2018-01-01')), 0)
+        self.assertEqual(steps_until(pd.Timestamp('2018-01-01'), day, pd.Timestamp('2018-01-03 12:00')), 2)
+
+class TrialsFrameTest(unittest.TestCase):
+
+    def test_frame(self):
+        paths = np.array([[0.0, 1.0, np.nan], [0.0, 1.0, 2.0]])
+        df = trials_frame(paths, pd.Timestamp('2018-01-01'), pd.tseries.frequencies.to_offset('W'))
+
+        self.assertEqual(list(df.columns), ['Trial 0', 'Trial 1'])
+        self.assertEqual(list(df.index), [pd.Timestamp('2018-01-01'), pd.Timestamp('2018-01-07'), pd.Timestamp('2018-01-14')])
+        self.assertEqual(df['Trial 0'].last_valid_index(), pd.Timestamp('2018-01-07'))
+
+    def test_finish_dates(self):
+        dates = finish_dates(np.array([1, 0, 2]), pd.Timestamp('2018-01-01'), pd.tseries.frequencies.to_offset('D'))
+
+        self.assertEqual(list(dates.index), ['Trial 0', 'Trial 1', 'Trial 2'])
+        self.assertEqual(list(dates), [pd.Timestamp('2018-01-02'), pd.Timestamp('2018-01-01'), pd.Timestamp('2018-01-03')])
+
+if __name__ == '__main__':
+    unittest.main()
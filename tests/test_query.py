@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import unittest
+import shutil
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from jira import JIRAError
+from jira_metrics_extract.query import IncompleteResults, QueryManager, RawPage, raw_issue
+
+class CappedJira(object):
+    """A JIRA client that returns at most `cap` issues per page, like JIRA
+    Cloud, optionally failing on the page starting at `fail_at`
+    """
+
+    _options = {'server': 'https://jira.example.com'}
+
+    def __init__(self, total, cap, fail_at=None, drop=0):
+        self.total = total
+        self.cap = cap
+        self.fail_at = fail_at
+        self.drop = drop
+
+    def fields(self):
+        return []
+
+    def search_issues(self, jql, expand=None, fields=None, maxResults=50, startAt=0):
+        if startAt == self.fail_at:
+            raise JIRAError(status_code=500, text='Server error')
+        page = RawPage({'key': 'PRJ-%d' % i} for i in range(startAt, min(startAt + min(maxResults, self.cap), self.total - self.drop)))
+        page.total = self.total
+        return page
+
+class ShiftingJira(CappedJira):
+    """A JIRA client ordering issues by last update, where the last issue
+    is updated, and so moves to the front, once the first page is fetched
+    """
+
+    def __init__(self, total, cap):
+        super(ShiftingJira, self).__init__(total, cap)
+        self.order = ['PRJ-%d' % i for i in range(total)]
+        self.fetched = False
+
+    def search_issues(self, jql, expand=None, fields=None, maxResults=50, startAt=0):
+        if self.fetched and self.order[0] == 'PRJ-0':
+            self.order.insert(0, self.order.pop())
+        self.fetched = True
+        page = RawPage({'key': key} for key in self.order[startAt:startAt + min(maxResults, self.cap)])
+        page.total = self.total
+        return page
+
+class FieldsJira(CappedJira):
+    """A JIRA client with the given custom fields, counting how often they
+    are fetched
+    """
+
+    def __init__(self, fields=None):
+        super(FieldsJira, self).__init__(0, 100)
+        self.custom_fields = [{'name': 'Lab', 'id': 'customfield_10001'}] if fields is None else fields
+        self.fetched = 0
+
+    def fields(self):
+        self.fetched += 1
+        return list(self.custom_fields)
+
+class ResolveFieldsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached_fields(self):
+        jira = FieldsJira(fields=[])
+        QueryManager(jira, cache_jira=self.directory)
+        QueryManager(jira, cache_jira=self.directory)
+        self.assertEqual(jira.fetched, 1)
+
+        # A field created since the list was cached is found by fetching it again
+        jira.custom_fields.append({'name': 'Lab', 'id': 'customfield_10001'})
+        q = QueryManager(jira, fields={'Lab': 'Lab'}, cache_jira=self.directory)
+        self.assertEqual(q.fields, {'Lab': 'customfield_10001'})
+        self.assertEqual(jira.fetched, 2)
+
+        # And the cache is rewritten
+        QueryManager(jira, fields={'Lab': 'Lab'}, cache_jira=self.directory)
+        self.assertEqual(jira.fetched, 2)
+
+        with self.assertRaises(Exception):
+            QueryManager(jira, fields={'Team': 'Team'}, cache_jira=self.directory)
+
+    def test_fields_per_instance(self):
+        with_lab = QueryManager(FieldsJira(), fields={'Lab': 'Lab'})
+        without = QueryManager(FieldsJira())
+
+        self.assertEqual(with_lab.fields, {'Lab': 'customfield_10001'})
+        self.assertIn('customfield_10001', with_lab.search_fields())
+        # Fields resolved for one instance do not leak into another
+        self.assertEqual(without.fields, {})
+        self.assertNotIn('customfield_10001', without.search_fields())
+
+class IterPagesTest(unittest.TestCase):
+
+    def keys(self, jira, concurrency):
+        q = QueryManager(jira, max_results=250, fetch_concurrency=concurrency)
+        return [issue['key'] for page in q.iter_pages('project = PRJ') for issue in page]
+
+    def test_capped_pages(self):
+        expected = ['PRJ-%d' % i for i in range(530)]
+        self.assertEqual(self.keys(CappedJira(530, 100), 1), expected)
+        self.assertEqual(self.keys(CappedJira(530, 100), 4), expected)
+
+    def test_missing_issues(self):
+        with self.assertRaises(IncompleteResults):
+            self.keys(CappedJira(530, 100, drop=20), 1)
+        with self.assertRaises(IncompleteResults):
+            self.keys(CappedJira(530, 100, drop=20), 4)
+
+    def test_shifting_issues(self):
+        expected = ['PRJ-%d' % i for i in range(530)]
+        for concurrency in (1, 4):
+            keys = self.keys(ShiftingJira(530, 100), concurrency)
+            self.assertEqual(sorted(keys), sorted(expected))
+            self.assertEqual(len(keys), len(expected))
+
+class IterIssuesTest(unittest.TestCase):
+
+    def test_error_is_raised(self):
+        q = QueryManager(CappedJira(530, 100, fail_at=200), max_results=100)
+        with self.assertRaises(JIRAError):
+            list(q.iter_issues({'project': ['PRJ']}))
+
+class QueryJira(object):
+    """A JIRA client with a set of `issues` (key to `updated` timestamp) of
+    which those in `matching` match any query. Understands just enough JQL
+    to select issues by key or by update date, and records the queries.
+    """
+
+    _options = {'server': 'https://jira.example.com'}
+    _session = None
+
+    def __init__(self, issues, matching):
+        self.issues = issues
+        self.matching = matching
+        self.queries = []
+
+    def fields(self):
+        return []
+
+    def search_issues(self, jql, expand=None, fields=None, maxResults=50, startAt=0):
+        self.queries.append(jql)
+
+        keys = [key for key in sorted(self.issues) if key in self.matching]
+        if 'key IN (' in jql:
+            keys = [key for key in keys if '"%s"' % key in jql]
+        since = re.search(r'updated >= "(\d{4})/(\d\d)/(\d\d)"', jql)
+        if since is not None:
+            keys = [key for key in keys if self.issues[key][:10] >= '-'.join(since.groups())]
+
+        page = RawPage(
+            {'key': key} if fields == 'key' else {'key': key, 'fields': {'updated': self.issues[key], 'summary': key}}
+            for key in keys[startAt:startAt + maxResults]
+        )
+        page.total = len(keys)
+        return page
+
+class IterCachedPagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def issues(self, jira):
+        q = QueryManager(jira, max_results=2, cache_jira=self.directory)
+        return [raw_issue(issue) for issue in q.iter_issues({'project': ['PRJ']})]
+
+    def test_updated(self):
+        jira = QueryJira({
+            'PRJ-1': '2018-01-01T10:00:00.000+0000',
+            'PRJ-2': '2018-01-10T10:00:00.000+0000',
+            'PRJ-3': '2018-01-10T10:00:00.000+0000',
+        }, matching=set(['PRJ-1', 'PRJ-2', 'PRJ-3']))
+        self.assertEqual([issue['key'] for issue in self.issues(jira)], ['PRJ-1', 'PRJ-2', 'PRJ-3'])
+
+        # PRJ-2 is updated and PRJ-3 no longer matches
+        jira.issues['PRJ-2'] = '2018-01-12T10:00:00.000+0000'
+        jira.matching.discard('PRJ-3')
+        jira.queries = []
+
+        issues = self.issues(jira)
+        self.assertEqual([issue['key'] for issue in issues], ['PRJ-1', 'PRJ-2'])
+        self.assertEqual(issues[1]['fields']['updated'], '2018-01-12T10:00:00.000+0000')
+        # Only issues updated since the day before the last run are fetched in full
+        self.assertTrue(any('updated >= "2018/01/09"' in query for query in jira.queries))
+
+    def test_newly_matching(self):
+        jira = QueryJira({
+            'PRJ-1': '2018-01-10T10:00:00.000+0000',
+            'PRJ-2': '2018-01-10T10:00:00.000+0000',
+            'PRJ-3': '2017-12-01T10:00:00.000+0000',
+            'PRJ-4': '2017-12-01T10:00:00.000+0000',
+            'PRJ-5': '2017-12-01T10:00:00.000+0000',
+        }, matching=set(['PRJ-1', 'PRJ-2']))
+        self.issues(jira)
+
+        # Issues not updated since the last run come to match the query,
+        # e.g. by being added to an open sprint
+        jira.matching.update(['PRJ-3', 'PRJ-4', 'PRJ-5'])
+
+        issues = self.issues(jira)
+        self.assertEqual([issue['key'] for issue in issues], ['PRJ-1', 'PRJ-2', 'PRJ-3', 'PRJ-4', 'PRJ-5'])
+        self.assertEqual(issues[2]['fields']['summary'], 'PRJ-3')
+        # And are cached for the next run
+        self.assertEqual([issue['key'] for issue in self.issues(jira)], ['PRJ-1', 'PRJ-2', 'PRJ-3', 'PRJ-4', 'PRJ-5'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import numpy as np
+import pandas as pd
+from jira_metrics_extract.sizes import SizeHistory, size_history_frame
+
+SIZE_DATA = pd.DataFrame({
+    'key': ['A-10', 'A-10', 'A-2', 'A-2'],
+    'fromDate': pd.to_datetime(['2018-01-01', '2018-01-03', '2018-01-02', '2018-01-04']),
+    'toDate': pd.to_datetime(['2018-01-03', '2018-01-05', '2018-01-04', '2018-01-05']),
+    'size': [None, 3.0, 1.0, 2.0],
+}, columns=['key', 'fromDate', 'toDate', 'size'])
+
+class SizeHistoryFrameTest(unittest.TestCase):
+
+    def test_dense(self):
+        df = size_history_frame(SIZE_DATA)
+
+        self.assertEqual(list(df.columns), ['A-2', 'A-10'])
+        self.assertEqual(list(df.index), list(pd.date_range('2018-01-01', '2018-01-05')))
+        np.testing.assert_array_equal(df['A-2'].values, [np.nan, 1, 1, 1, 2])
+        # The interval with a size wins on the day both cover
+        np.testing.assert_array_equal(df['A-10'].values, [np.nan, np.nan, 3, 3, 3])
+
+class SizeHistoryTest(unittest.TestCase):
+
+    def test_runs(self):
+        history = SizeHistory(SIZE_DATA)
+        self.assertEqual(len(history), 4)  # A-2: 1, 2; A-10: NaN, 3
+
+    def test_sizes_on(self):
+        history = SizeHistory(SIZE_DATA)
+        dense = size_history_frame(SIZE_DATA)
+
+        for date in dense.index:
+            np.testing.assert_array_equal(history.sizes_on(date).values, dense.loc[date].values)
+
+        sizes = history.sizes_on('2018-01-04', ['A-10', 'B-1', 'A-2'])
+        self.assertEqual(list(sizes.index), ['A-10', 'B-1', 'A-2'])
+        np.testing.assert_array_equal(sizes.values, [3, np.nan, 1])
+        self.assertTrue(history.sizes_on('2017-12-31').isnull().all())
+        self.assertTrue(history.sizes_on('2018-01-06').isnull().all())
+
+    def test_gap(self):
+        # No size interval covers 2018-01-03 or 2018-01-04
+        size_data = pd.DataFrame({
+            'key': ['A-1', 'B-1'],
+            'fromDate': pd.to_datetime(['2018-01-01', '2018-01-05']),
+            'toDate': pd.to_datetime(['2018-01-02', '2018-01-06']),
+            'size': [1.0, 2.0],
+        }, columns=['key', 'fromDate', 'toDate', 'size'])
+        history = SizeHistory(size_data)
+        dense = size_history_frame(size_data)
+
+        np.testing.assert_array_equal(history.sizes_on('2018-01-04').values, [1, np.nan])
+        for date in dense.index:
+            np.testing.assert_array_equal(history.sizes_on(date).values, dense.loc[date].values)
+        self.assertTrue(history.to_frame().equals(dense))
+
+    def test_to_frame(self):
+        self.assertTrue(SizeHistory(SIZE_DATA).to_frame().equals(size_history_frame(SIZE_DATA)))
+
+if __name__ == '__main__':
+    unittest.main()
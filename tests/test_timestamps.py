@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+import datetime
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import dateutil.parser
+from jira_metrics_extract.timestamps import parse_timestamp
+
+class ParseTimestampTest(unittest.TestCase):
+
+    def test_matches_dateutil(self):
+        for value in ['2017-07-10T09:21:57.112+0100',
+                      '2017-07-10T09:21:57.112+0000',
+                      '2017-07-10T09:21:57.112-0530',
+                      '2015-11-11T23:46:59',
+                      '2017-07-10',
+                      '2017-07-10T09:21:57+01:00']:
+            expected = dateutil.parser.parse(value)
+            actual = parse_timestamp(value)
+            self.assertEqual(actual, expected)
+            self.assertEqual(actual.utcoffset(), expected.utcoffset())
+
+    def test_naive_timestamp(self):
+        self.assertEqual(parse_timestamp('2015-11-11 23:46:59'), datetime.datetime(2015, 11, 11, 23, 46, 59))
+
+    def test_memoised(self):
+        self.assertIs(parse_timestamp('2016-01-02T03:04:05.006+0000'), parse_timestamp('2016-01-02T03:04:05.006+0000'))
+
+if __name__ == '__main__':
+    unittest.main()